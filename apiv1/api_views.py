@@ -11,7 +11,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
-from apiv1.filters import TopicsSearchFilter
+from apiv1.filters import TopicsSearchFilter, TopicsSortFilter
 from apiv1.serializers import (
     CommentSerializer,
     DefaultErrorSerializer,
@@ -24,6 +24,7 @@ from apiv1.serializers import (
 from error_messages.forum_error_messages import TOPICS_ERRORS
 from forum_app.constants import dict_sections
 from forum_app.models import Topic
+from home_app.models import UserRating
 from schemora.core.enums import RequestHost
 from schemora.settings.helpers import get_user_settings
 from services.forum_mixins import AddInstanceMixin, DeleteTopicMixin, get_topic_and_validate_section
@@ -62,7 +63,7 @@ class TopicViewSet(GenericViewSet, mixins.ListModelMixin, mixins.DestroyModelMix
     lookup_url_kwarg = "ids"
     serializer_class = TopicsSerializer
 
-    filter_backends = (TopicsSearchFilter,)
+    filter_backends = (TopicsSearchFilter, TopicsSortFilter)
     search_fields = "title", "question", "author__username"
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
@@ -118,6 +119,7 @@ class GetSectionTopicsAPIView(ListAPIView):
 
     serializer_class = TopicsSerializer
     lookup_url_kwarg = "section"
+    filter_backends = (TopicsSortFilter,)
 
     def get_queryset(self):
         return Topic.objects.filter(section=self.kwargs[self.lookup_url_kwarg])
@@ -132,6 +134,7 @@ class GetTopicCommentsAPIView(ListAPIView):
 
     serializer_class = CommentSerializer
     lookup_url_kwarg = "ids"
+    cursor_ordering = ("time_added", "id")
 
     def get_queryset(self):
         return get_object_or_404(Topic, pk=self.kwargs[self.lookup_url_kwarg]).comments
@@ -166,7 +169,8 @@ class GetUserAPIView(APIView):
     })
     def get(self, request: Request, ids: int) -> Response:
         user = get_object_or_404(User, pk=ids)
-        context = {"request": request, "settings": get_user_settings(user)}
+        context = {"request": request, "settings": get_user_settings(user),
+                   "rating": UserRating.objects.get_for_user(user)}
         data = self.serializer_class(user, context=context)
         return Response({"user": data.data}, status=status.HTTP_200_OK)
 
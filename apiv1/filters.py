@@ -1,7 +1,12 @@
+from typing import Dict, List
+
+from django.db.models import QuerySet
 from rest_framework import filters
 from rest_framework.request import Request
+from rest_framework.views import APIView
 
-from forum_app.constants import SearchParamsExpressions
+from forum_app.constants import SearchParamsExpressions, TopicSortExpressions
+from services.search_backends import get_search_backend
 
 
 class TopicsSearchFilter(filters.SearchFilter):
@@ -10,3 +15,40 @@ class TopicsSearchFilter(filters.SearchFilter):
         if len(search_fields) > 0:
             return search_fields
         return super().get_search_fields(view, request)
+
+    def filter_queryset(self, request: Request, queryset: QuerySet, view: APIView) -> QuerySet:
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+        backend = get_search_backend()
+        queryset = backend.filter_queryset(queryset, search_terms, search_fields)
+        if not backend.ordering:
+            return queryset
+        view.cursor_ordering = backend.ordering
+        return queryset.order_by(*backend.ordering)
+
+
+class TopicsSortFilter(filters.BaseFilterBackend):
+    """
+    Сортировка списка тем параметром '?sort=' (TopicSortExpressions). Порядок передается
+    и курсорной пагинации через атрибут вьюшки 'cursor_ordering'.
+    """
+
+    sort_param = "sort"
+
+    def filter_queryset(self, request: Request, queryset: QuerySet, view: APIView) -> QuerySet:
+        ordering = TopicSortExpressions.Params.get(request.query_params.get(self.sort_param, ""))
+        if not ordering:
+            return queryset
+        view.cursor_ordering = ordering
+        return queryset.order_by(*ordering)
+
+    def get_schema_operation_parameters(self, view: APIView) -> List[Dict]:
+        return [{
+            "name": self.sort_param,
+            "required": False,
+            "in": "query",
+            "description": "Сортировка тем.",
+            "schema": {"type": "string", "enum": list(TopicSortExpressions.Params.keys())},
+        }]
@@ -0,0 +1,127 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from django.db.models import QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
+
+from services.pagination import DEFAULT_KEYSET_ORDERING, KeysetPage, Ordering, decode_cursor, paginate_keyset
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Пагинация по непрозрачному курсору, упорядоченная по (time_added, id).
+    Не выполняет COUNT(*) и OFFSET: каждая страница - один индексируемый запрос.
+    Порядок можно переопределить атрибутом вьюшки 'cursor_ordering'.
+    """
+
+    cursor_query_param = "cursor"
+    cursor_query_description = "Значение курсора, полученное из ссылок next/previous."
+    invalid_cursor_message = "Invalid cursor"
+    page_size = api_settings.PAGE_SIZE
+    ordering: Ordering = DEFAULT_KEYSET_ORDERING
+
+    request: Optional[Request] = None
+    page: Optional[KeysetPage] = None
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view: Optional[APIView] = None) -> List:
+        self.request = request
+        ordering = getattr(view, "cursor_ordering", self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor and decode_cursor(cursor, ordering, queryset) is None:
+            raise NotFound(self.invalid_cursor_message)
+        self.page = paginate_keyset(queryset, cursor, self.page_size, ordering)
+        return self.page.objects
+
+    def get_next_link(self) -> Optional[str]:
+        return self._get_link(self.page.next_cursor if self.page else None)
+
+    def get_previous_link(self) -> Optional[str]:
+        return self._get_link(self.page.previous_cursor if self.page else None)
+
+    def _get_link(self, cursor: Optional[str]) -> Optional[str]:
+        if not cursor or self.request is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data: List) -> Response:
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data)
+        ]))
+
+    def get_paginated_response_schema(self, schema: Dict) -> Dict:
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view: APIView) -> List[Dict]:
+        return [{
+            "name": self.cursor_query_param,
+            "required": False,
+            "in": "query",
+            "description": self.cursor_query_description,
+            "schema": {"type": "string"},
+        }]
+
+
+class SelectablePagination(BasePagination):
+    """
+    Пагинация с выбором режима. По умолчанию - limit/offset (обратная совместимость),
+    курсорный режим включается параметром '?pagination=cursor' (или наличием параметра 'cursor'),
+    либо для всей вьюшки атрибутом 'pagination_mode = "cursor"'.
+    """
+
+    mode_query_param = "pagination"
+    cursor_mode = "cursor"
+    offset_mode = "offset"
+
+    def __init__(self):
+        self.paginators = {
+            self.offset_mode: LimitOffsetPagination(),
+            self.cursor_mode: KeysetCursorPagination(),
+        }
+        self.paginator = self.paginators[self.offset_mode]
+
+    def get_mode(self, request: Request, view: Optional[APIView] = None) -> str:
+        mode = request.query_params.get(self.mode_query_param, getattr(view, "pagination_mode", self.offset_mode))
+        if self.paginators[self.cursor_mode].cursor_query_param in request.query_params:
+            mode = self.cursor_mode
+        return mode if mode in self.paginators else self.offset_mode
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view: Optional[APIView] = None) -> Optional[List]:
+        self.paginator = self.paginators[self.get_mode(request, view)]
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data: List) -> Response:
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema: Dict) -> Dict:
+        cursor_schema = self.paginators[self.cursor_mode].get_paginated_response_schema(schema)
+        offset_schema = self.paginators[self.offset_mode].get_paginated_response_schema(schema)
+        return {"oneOf": [offset_schema, cursor_schema]}
+
+    def get_schema_operation_parameters(self, view: APIView) -> List[Dict]:
+        return [
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Режим пагинации.",
+                "schema": {"type": "string", "enum": list(self.paginators.keys())},
+            },
+            *(parameter for paginator in self.paginators.values()
+              for parameter in paginator.get_schema_operation_parameters(view)),
+        ]
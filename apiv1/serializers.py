@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
 from django.contrib.auth.models import User
+from django.db.models import Manager
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
 from forum_app.models import Comment, Topic, get_image_link
-from home_app.models import Review, UserRating
-from schemora.settings.helpers import get_instance_datetime_attribute, get_user_settings, get_user_settings_model
+from schemora.settings.helpers import get_user_settings_loader, get_user_settings_model
+from services.image_variants import validate_image_pixels
+from services.timezones import get_request_timezone_formatter
 from services.user_settings import settings
+from services.views_buffer import get_views_buffer
 
 UserSettings = get_user_settings_model()
 
@@ -30,29 +36,59 @@ class UpdateSettingsSerializer(serializers.ModelSerializer):
 
 @extend_schema_field(OpenApiTypes.STR)
 class CustomImageField(serializers.ImageField):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.validators.append(validate_image_pixels)
+
     def to_representation(self, value):
         return get_image_link(value)
 
 
+@extend_schema_field(serializers.DictField)
+class UserTimezoneDateTimeField(serializers.ReadOnlyField):
+    """ Дата в зоне текущего пользователя: {<имя поля>: "H:M d/m/Y", "time_zone": <зона из его настроек>}. """
+
+    def to_representation(self, value: Optional[datetime]) -> Dict[str, Optional[str]]:
+        formatter = get_request_timezone_formatter(self.context["request"])
+        return {self.field_name: formatter.format(value), "time_zone": formatter.timezone}
+
+
+class _InstanceListSerializer(serializers.ListSerializer):
+    """ Перед сериализацией загружает настройки всех нужных пользователей страницы одним пакетом. """
+
+    def to_representation(self, data: Iterable[Topic | Comment] | Manager) -> List[Dict]:
+        instances = list(data.all() if isinstance(data, Manager) else data)
+        request = self.context.get("request")
+        if request is not None:
+            users = [instance.author_id for instance in instances] if "author_signature" in self.child.fields else []
+            get_user_settings_loader(request).load_many(users + ([request.user.pk] if request.user.is_authenticated
+                                                                 else []))
+        return super().to_representation(instances)
+
+
 class _InstanceSerializer(serializers.ModelSerializer):
     upload = CustomImageField(required=False)
-    time_added = serializers.SerializerMethodField(read_only=True)
+    time_added = UserTimezoneDateTimeField()
     author_signature = serializers.SerializerMethodField(read_only=True)
 
-    @extend_schema_field(serializers.DictField)
-    def get_time_added(self, topic):
-        return get_instance_datetime_attribute(self.context["request"].user, topic)
-
     @extend_schema_field(OpenApiTypes.STR)
     def get_author_signature(self, comment):
-        return get_user_settings(comment.author).signature
+        return get_user_settings_loader(self.context["request"]).get(comment.author_id).signature
+
+
+class TopicsListSerializer(_InstanceListSerializer):
+    def to_representation(self, data: Iterable[Topic | Comment] | Manager) -> List[Dict]:
+        topics = list(data.all() if isinstance(data, Manager) else data)
+        get_views_buffer().add_pending_views(topics)
+        return super().to_representation(topics)
 
 
 class TopicsSerializer(_InstanceSerializer):
     class Meta:
         model = Topic
-        fields = "id", "title", "views", "author", "section", "time_added"
-        read_only_fields = "id", "views", "author", "time_added"
+        list_serializer_class = TopicsListSerializer
+        fields = "id", "title", "views", "author", "section", "time_added", "comments_count", "last_activity_at"
+        read_only_fields = "id", "views", "author", "time_added", "comments_count", "last_activity_at"
 
 
 class TopicDetailSerializer(_InstanceSerializer):
@@ -70,39 +106,44 @@ class CommentSerializer(_InstanceSerializer):
         model = Comment
         fields = "id", "topic", "comment", "author", "upload", "time_added", "author_signature"
         read_only_fields = "id", "author", "time_added", "author_signature"
+        list_serializer_class = _InstanceListSerializer
 
 
 class UserSerializer(serializers.ModelSerializer):
     avatar = serializers.SerializerMethodField(read_only=True)
-    date_joined = serializers.SerializerMethodField(read_only=True)
-    last_login = serializers.SerializerMethodField(read_only=True)
+    date_joined = UserTimezoneDateTimeField()
+    last_login = UserTimezoneDateTimeField()
     rating = serializers.SerializerMethodField(read_only=True)
     reviews_count = serializers.SerializerMethodField(read_only=True)
+    likes = serializers.SerializerMethodField(read_only=True)
+    dislikes = serializers.SerializerMethodField(read_only=True)
     signature = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = User
-        fields = "id", "username", "avatar", "date_joined", "last_login", "rating", "reviews_count", "signature"
+        fields = ("id", "username", "avatar", "date_joined", "last_login", "rating", "reviews_count", "likes",
+                  "dislikes", "signature")
 
     @extend_schema_field(OpenApiTypes.STR)
     def get_avatar(self, user):
-        return get_image_link(self.context["settings"].avatar)
-
-    @extend_schema_field(serializers.DictField)
-    def get_date_joined(self, user):
-        return get_instance_datetime_attribute(self.context["request"].user, user, attribute="date_joined")
-
-    @extend_schema_field(serializers.DictField)
-    def get_last_login(self, user):
-        return get_instance_datetime_attribute(self.context["request"].user, user, attribute="last_login")
+        user_settings = self.context["settings"]
+        return get_image_link(user_settings.avatar, user_settings.avatar_version)
 
     @extend_schema_field(OpenApiTypes.INT)
     def get_rating(self, user):
-        return UserRating.objects.get(user=user).rating
+        return self.context["rating"].rating
 
     @extend_schema_field(OpenApiTypes.INT)
     def get_reviews_count(self, user):
-        return Review.objects.filter(user=user).count()
+        return self.context["rating"].reviews_count
+
+    @extend_schema_field(OpenApiTypes.INT)
+    def get_likes(self, user: User) -> int:
+        return self.context["rating"].likes
+
+    @extend_schema_field(OpenApiTypes.INT)
+    def get_dislikes(self, user: User) -> int:
+        return self.context["rating"].dislikes
 
     @extend_schema_field(OpenApiTypes.STR)
     def get_signature(self, user):
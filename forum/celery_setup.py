@@ -7,11 +7,19 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'forum.settings')
 
 app = Celery(
     'Omenforcer',
-    include=['tasks'],
+    include=['tasks', 'tasks.forum_app_tasks'],
     broker=settings.CELERY_BROKER_URL,
     backend=settings.CELERY_RESULT_BACKEND
 )
 app.conf.task_routes = {
-    "tasks.make_center_crop": {"queue": "main_queue"},
+    "tasks.home_app_tasks.make_center_crop": {"queue": "main_queue"},
+    "tasks.home_app_tasks.make_image_variants": {"queue": "main_queue"},
+    "tasks.home_app_tasks.make_image_variants_batch": {"queue": "main_queue"},
+}
+app.conf.beat_schedule = {
+    "flush-topic-views": {
+        "task": "tasks.forum_app_tasks.flush_topic_views",
+        "schedule": settings.FORUM_VIEWS_FLUSH_INTERVAL,
+    },
 }
 app.autodiscover_tasks()
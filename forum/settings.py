@@ -38,6 +38,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'schemora.settings.middleware.UserSettingsMemoMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -77,12 +78,25 @@ DATABASES = {
 # CELERY
 CELERY_BROKER_URL = env("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = env("CELERY_RESULT_BACKEND")
+# Период (в секундах) переноса буфера просмотров тем в базу (tasks.forum_app_tasks.flush_topic_views).
+FORUM_VIEWS_FLUSH_INTERVAL = 60
 
 # PROJECT RUNTIME SETTINGS
 CUSTOM_USER_AVATARS_DIR = "avatars"
 CUSTOM_TOPIC_UPLOADS_DIR = "t_images"
 CUSTOM_COMMENT_UPLOADS_DIR = "c_images"
 
+# Размеры (в пикселях) центрированных вариантов аватарок и вложений (services.image_variants).
+IMAGE_VARIANT_SIZES = (64, 175, 400)
+# Наибольшее количество пикселей изображения по его заголовку и после декодирования (JPEG декодируется
+# с уменьшением, поэтому большие JPEG проходят вторую проверку). Изображения больше не обрабатываются.
+IMAGE_MAX_PIXELS = 100_000_000
+IMAGE_MAX_DECODED_PIXELS = 25_000_000
+# Количество процессов пакетной обработки изображений (tasks.home_app_tasks.make_image_variants_batch).
+IMAGE_BATCH_PROCESSES = int(env("IMAGE_BATCH_PROCESSES", default=4))
+# Количество файлов вложений, удаляемых одной таской (forum_app.models.schedule_upload_deletion).
+UPLOADS_DELETE_BATCH_SIZE = 500
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -107,10 +121,26 @@ CACHES = {
 }
 
 # CACHE VARIABLES NAMES
-LAST_JOINED_CACHE_NAME = "last_joined_user"
-TOTAL_TOPICS_CACHE_NAME = "total_topics_count"
-TOTAL_COMMENTS_CACHE_NAME = "total_comments_count"
-AGGREGATE_COUNT_CACHE_NAME = "aggregate_count_topics_in_sections"
+FORUM_STATS_CACHE_NAME = "forum_stats"
+TOPIC_FRAGMENTS_VERSION_CACHE_NAME = "topic_fragments_version"
+FORUM_PAGES_VERSION_CACHE_NAME = "forum_pages_version"
+FORUM_PAGE_CACHE_NAME = "forum_page"
+SEARCH_INDEX_VERSION_CACHE_NAME = "search_index_version"
+
+# Время жизни закэшированных фрагментов страницы темы (заголовка и страниц комментариев) в секундах.
+TOPIC_FRAGMENTS_CACHE_TIMEOUT = 60*60*24
+
+# Время жизни страниц форума, закэшированных для анонимных читателей, в секундах. Страницы сбрасываются
+# версиями данных, а таймаут ограничивает устаревание итогов форума и счетчиков просмотров на них.
+FORUM_PAGE_CACHE_TIMEOUT = 60
+
+# Сводка информационной панели форума (services.forum_stats): срок годности в секундах, во сколько раз
+# дольше запись хранится для отдачи устаревшей сводки во время обновления, таймаут блокировки обновления
+# и коэффициент раннего обновления (больше - раньше).
+FORUM_STATS_CACHE_TIMEOUT = 60
+FORUM_STATS_STALE_FACTOR = 10
+FORUM_STATS_LOCK_TIMEOUT = 10
+FORUM_STATS_XFETCH_BETA = 1.0
 
 LOGGING = {
     "version": 1,
@@ -127,6 +157,11 @@ LOGGING = {
     }
 }
 
+# SEARCH
+# services.search_backends: ORMSearchBackend, PostgresFullTextSearchBackend, TrigramSearchBackend (не PostgreSQL)
+FORUM_SEARCH_BACKEND = env("FORUM_SEARCH_BACKEND", default="services.search_backends.PostgresFullTextSearchBackend")
+FORUM_SEARCH_CONFIG = "russian"
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -149,7 +184,7 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.TokenAuthentication"
     ],
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
+    "DEFAULT_PAGINATION_CLASS": "apiv1.pagination.SelectablePagination",
     "PAGE_SIZE": 20,
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
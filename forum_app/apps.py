@@ -1,6 +1,17 @@
+from typing import Literal
+
 from django.apps import AppConfig
 
 
 class ForumAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'forum_app'
+
+    def ready(self) -> Literal[None]:
+        from services import image_variants, page_cache, topic_fragments
+        from services.search_backends import get_search_backend
+
+        get_search_backend().connect_signals()
+        topic_fragments.connect_signals()
+        page_cache.connect_signals()
+        image_variants.connect_signals()
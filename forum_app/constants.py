@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Tuple
 
 from error_messages.forum_error_messages import ModelField
 
@@ -29,4 +29,11 @@ class SearchParamsExpressions(object):
     Params: Dict[str, ModelField] = {"title": "title", "question": "question", "username": "author__username"}
 
 
+class TopicSortExpressions(object):
+    LAST_ACTIVITY = "last_activity"
+
+    # Значение параметра 'sort' -> порядок keyset-пагинации (покрыт индексами модели Topic).
+    Params: Dict[str, Tuple[ModelField, ...]] = {LAST_ACTIVITY: ("-last_activity_at", "-id")}
+
+
 dict_sections = {key: value for key, value in Sections.Sections}
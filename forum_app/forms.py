@@ -2,12 +2,14 @@ from django import forms
 from django.core.validators import MaxLengthValidator, MinLengthValidator
 
 from forum_app.models import Comment, Topic
+from services.image_variants import validate_image_pixels
 
 
 class AddTopicForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["upload"].required = False
+        self.fields["upload"].validators.append(validate_image_pixels)
         self.fields["section"].required = False
 
     class Meta:
@@ -52,6 +54,7 @@ class AddCommentForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["upload"].required = False
+        self.fields["upload"].validators.append(validate_image_pixels)
 
     class Meta:
         model = Comment
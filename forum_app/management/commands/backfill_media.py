@@ -0,0 +1,149 @@
+import os
+from dataclasses import dataclass
+from datetime import timedelta
+from itertools import tee
+from time import perf_counter, sleep
+from typing import Iterator, List, Optional
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.utils import timezone
+
+from forum_app.models import get_temporary_upload_objects, rename_temporary_upload
+from services.image_variants import (
+    backfill_upload_versions,
+    find_upload_images,
+    is_image_variants_stale,
+    iter_image_variants_batches,
+)
+from services.page_cache import bump_instance_pages_versions
+from tasks.home_app_tasks import make_image_variants
+
+
+@dataclass
+class BackfillProgress:
+    scanned: int = 0
+    processed: int = 0
+    failed: int = 0
+    # Последний просмотренный путь пакета: после обработки пакета он записывается в файл продолжения.
+    last_path: Optional[str] = None
+
+
+class Command(BaseCommand):
+    help = ("Находит загрузки (вложения тем, комментариев и аватары) без вариантов изображений или с устаревшими "
+            "вариантами (другие размеры, форматы, версия манифеста, исходный файл новее) и создает их заново "
+            "в пуле процессов. Повторный запуск пропускает актуальные варианты, а с --checkpoint продолжает "
+            "обход с места остановки. После смены IMAGE_VARIANT_SIZES или VARIANT_FORMATS достаточно запустить "
+            "команду снова. Перед обходом вложения, оставшиеся под временным именем (tmp_), получают имя "
+            "по первичному ключу.")
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                            help="Количество процессов (по умолчанию - количество ядер).")
+        parser.add_argument("--batch-size", type=int, default=64,
+                            help="Количество изображений в пакете: после каждого пакета выводится прогресс.")
+        parser.add_argument("--max-rate", type=float, default=0,
+                            help="Не больше стольких изображений в секунду (0 - без ограничения).")
+        parser.add_argument("--checkpoint", help="Файл с последним обработанным путем для продолжения обхода.")
+        parser.add_argument("--restart", action="store_true", help="Начать обход сначала, не читая --checkpoint.")
+        parser.add_argument("--force", action="store_true", help="Пересоздать варианты всех изображений.")
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать изображения для обработки.")
+        parser.add_argument("--skip-versions", action="store_true",
+                            help="Не заполнять версии содержимого старых загрузок.")
+        parser.add_argument("--skip-temporary", action="store_true",
+                            help="Не переименовывать вложения, оставшиеся под временным именем.")
+        parser.add_argument("--temporary-age", type=int, default=60,
+                            help="Переименовывать временные вложения объектов, добавленных не меньше стольких "
+                                 "минут назад: у новых переименование еще может идти (по умолчанию 60).")
+        parser.add_argument("--directories", nargs="+", help="Каталоги MEDIA_ROOT для обхода.")
+
+    def handle(self, *args, **options) -> None:
+        checkpoint = options["checkpoint"]
+        start_after = None if options["restart"] else self._read_checkpoint(checkpoint)
+        if start_after:
+            self.stdout.write(f"Продолжение после {start_after}.")
+
+        if not options["skip_temporary"]:
+            self._rename_temporary_uploads(options["temporary_age"], options["dry_run"])
+
+        progress, started = BackfillProgress(), perf_counter()
+        batches = self._iter_batches(progress, start_after, options)
+        if options["dry_run"]:
+            stale = sum(len(batch) for batch in batches)
+            self.stdout.write(self.style.SUCCESS(f"Просмотрено {progress.scanned}, для обработки {stale}."))
+            return
+
+        batches, pending = tee(batches)
+        for batch, result in zip(pending, iter_image_variants_batches(batches, options["processes"])):
+            progress.processed += len(batch)
+            progress.failed += len(result.failed)
+            for path, error in result.failed.items():
+                self.stderr.write(f"{path}: {error}")
+            self._write_checkpoint(checkpoint, progress.last_path)
+            elapsed = perf_counter() - started
+            self.stdout.write(f"{progress.last_path}: просмотрено {progress.scanned}, обработано {progress.processed}, "
+                              f"ошибок {progress.failed}, {progress.processed / elapsed:.2f} изобр./с.")
+            if options["max_rate"] > 0:
+                sleep(max(progress.processed / options["max_rate"] - elapsed, 0))
+
+        # Обход завершен: следующий запуск начнется сначала.
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = perf_counter() - started
+        style = self.style.SUCCESS if not progress.failed else self.style.ERROR
+        self.stdout.write(style(
+            f"Просмотрено {progress.scanned}, обработано {progress.processed}, ошибок {progress.failed} "
+            f"за {elapsed:.1f} с ({progress.processed / elapsed if elapsed else 0:.2f} изобр./с)."
+        ))
+        if not options["skip_versions"]:
+            self.stdout.write(self.style.SUCCESS(f"Заполнено версий загрузок: {backfill_upload_versions()}."))
+
+    def _rename_temporary_uploads(self, age: int, dry_run: bool) -> None:
+        # Как после добавления объекта (AddInstanceMixin): новые версии страниц и таска создания вариантов.
+        renamed = failed = 0
+        for instance in get_temporary_upload_objects(timezone.now() - timedelta(minutes=age)):
+            if dry_run:
+                renamed += 1
+                continue
+            try:
+                if rename_temporary_upload(instance):
+                    bump_instance_pages_versions(instance)
+                    make_image_variants.delay(instance.upload.path)
+                    renamed += 1
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f"{instance.upload.name}: {error}")
+        style = self.style.SUCCESS if not failed else self.style.ERROR
+        self.stdout.write(style(f"Временных вложений {'найдено' if dry_run else 'переименовано'}: {renamed}, "
+                                f"ошибок {failed}."))
+
+    @staticmethod
+    def _iter_batches(progress: BackfillProgress, start_after: Optional[str], options: dict) -> Iterator[List[str]]:
+        batch = list()
+        for path in find_upload_images(options["directories"]):
+            if start_after is not None and path <= start_after:
+                continue
+            progress.scanned += 1
+            if options["force"] or is_image_variants_stale(path):
+                batch.append(path)
+            if len(batch) >= options["batch_size"]:
+                progress.last_path = path
+                yield batch
+                batch = list()
+        if batch:
+            progress.last_path = batch[-1]
+            yield batch
+
+    @staticmethod
+    def _read_checkpoint(checkpoint: Optional[str]) -> Optional[str]:
+        if not checkpoint or not os.path.exists(checkpoint):
+            return None
+        with open(checkpoint) as file:
+            return file.read().strip() or None
+
+    @staticmethod
+    def _write_checkpoint(checkpoint: Optional[str], path: Optional[str]) -> None:
+        if not checkpoint or path is None:
+            return
+        with open(f"{checkpoint}.tmp", "w") as file:
+            file.write(path)
+        os.replace(f"{checkpoint}.tmp", checkpoint)
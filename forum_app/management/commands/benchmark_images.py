@@ -0,0 +1,88 @@
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from math import sqrt
+from random import Random
+from statistics import mean, quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from django.test import override_settings
+from PIL import Image
+
+from services.image_variants import build_image_variants, build_image_variants_batch
+
+FORMATS = {"jpeg": ("JPEG", "jpg"), "png": ("PNG", "png")}
+
+
+def _measure_sequential(paths: List[str], draft: bool) -> Tuple[List[float], int]:
+    # Выполняется в отдельном процессе, чтобы пиковая память (ru_maxrss) относилась только к замеру.
+    timings = list()
+    for path in paths:
+        started = perf_counter()
+        build_image_variants(path, draft=draft)
+        timings.append((perf_counter() - started) * 1000)
+    return timings, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = ("Измеряет пропускную способность создания вариантов изображений (services.image_variants) "
+            "на сгенерированных изображениях: по очереди с уменьшением при декодировании и без него, "
+            "и пакетом в пуле процессов. Помогает подобрать количество воркеров main_queue.")
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--images", type=int, default=20, help="Количество изображений каждого формата.")
+        parser.add_argument("--megapixels", type=float, default=12, help="Размер изображений в мегапикселях.")
+        parser.add_argument("--formats", nargs="+", choices=FORMATS.keys(), default=list(FORMATS.keys()))
+        parser.add_argument("--processes", type=int, default=settings.IMAGE_BATCH_PROCESSES,
+                            help="Количество процессов пакетной обработки.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options) -> None:
+        # Ограничение декодированных пикселей снято, чтобы сравнить с декодированием без уменьшения.
+        with TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root,
+                                                                   IMAGE_MAX_DECODED_PIXELS=settings.IMAGE_MAX_PIXELS):
+            for format_name in options["formats"]:
+                paths = self._generate(media_root, format_name, options)
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f"{format_name.upper()}, {len(paths)} x {options['megapixels']} Мп:"
+                ))
+                for draft in (True, False):
+                    with ProcessPoolExecutor(1) as pool:
+                        timings, max_rss = pool.submit(_measure_sequential, paths, draft).result()
+                    p95 = quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+                    self.stdout.write(
+                        f"  {'с уменьшением при декодировании' if draft else 'полное декодирование'}: "
+                        f"среднее {mean(timings):.1f} мс, p95 {p95:.1f} мс, "
+                        f"{1000 / mean(timings):.2f} изобр./с, пик памяти {max_rss / 1024:.0f} МБ."
+                    )
+                started = perf_counter()
+                result = build_image_variants_batch(paths, options["processes"])
+                elapsed = perf_counter() - started
+                style = self.style.SUCCESS if not result.failed else self.style.ERROR
+                self.stdout.write(style(
+                    f"  пакет, {options['processes']} процесса(ов): {result.processed / elapsed:.2f} изобр./с, "
+                    f"ошибок: {len(result.failed)}."
+                ))
+
+    def _generate(self, media_root: str, format_name: str, options: dict) -> List[str]:
+        rnd = Random(options["seed"])
+        image_format, extension = FORMATS[format_name]
+        width = int(sqrt(options["megapixels"] * 1_000_000 * 4 / 3))
+        height = width * 3 // 4
+        directory = os.path.join(media_root, "benchmark")
+        os.makedirs(directory, exist_ok=True)
+        gradient = Image.linear_gradient("L")
+        paths = list()
+        for i in range(options["images"]):
+            # Градиенты с шумом сжимаются как фотографии, а не как однотонная заливка.
+            bands = [gradient.rotate(rnd.randint(0, 359)).resize((width, height)) for _ in range(3)]
+            noise = Image.effect_noise((width, height), rnd.randint(10, 40))
+            img = Image.merge("RGB", [Image.blend(band, noise, 0.2) for band in bands])
+            path = os.path.join(directory, f"{format_name}_{i}.{extension}")
+            img.save(path, image_format)
+            paths.append(path)
+        return paths
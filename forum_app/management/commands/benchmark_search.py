@@ -0,0 +1,83 @@
+from random import Random
+from statistics import mean, quantiles
+from time import perf_counter
+from typing import List, Sequence, Set, Tuple
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from forum_app.constants import SearchParamsExpressions, Sections
+from forum_app.models import Topic
+from services.search_backends import BaseSearchBackend, ORMSearchBackend, TrigramSearchBackend
+
+SYLLABLES = ("ка", "ро", "ми", "на", "то", "ли", "ze", "ra", "po", "lin", "ter", "mo", "vi", "so", "de", "qu")
+WORDS = (
+    "django", "queryset", "migration", "celery", "redis", "postgres", "serializer", "viewset", "template",
+    "middleware", "signal", "cache", "index", "deploy", "docker", "nginx", "gunicorn", "pytest", "fixture",
+    "модель", "запрос", "ошибка", "шаблон", "форма", "кэш", "индекс", "сериализатор", "тест", "задача",
+)
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает поиск тем через ORM (icontains) и TrigramSearchBackend на сгенерированных данных. "
+            "Данные создаются в транзакции, которая откатывается после замеров.")
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--topics", type=int, default=20000, help="Количество сгенерированных тем.")
+        parser.add_argument("--queries", type=int, default=200, help="Количество поисковых запросов.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options) -> None:
+        rnd = Random(options["seed"])
+        words = list(WORDS) + ["".join(rnd.choices(SYLLABLES, k=rnd.randint(2, 4))) for _ in range(5000)]
+        with transaction.atomic():
+            self._generate(rnd, words, options["topics"])
+            queries = self._get_queries(rnd, words, options["queries"])
+            trigram = TrigramSearchBackend()
+            started = perf_counter()
+            trigram.rebuild()
+            self.stdout.write(f"Индекс триграмм построен за {(perf_counter() - started) * 1000:.1f} мс.")
+
+            results = {backend.__class__.__name__: self._measure(backend, queries)
+                       for backend in (ORMSearchBackend(), trigram)}
+            transaction.set_rollback(True)
+
+        (_, orm_found), (_, trigram_found) = results.values()
+        for name, (timings, _) in results.items():
+            p95 = quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+            self.stdout.write(f"{name}: среднее {mean(timings):.2f} мс, p95 {p95:.2f} мс.")
+        mismatches = sum(a != b for a, b in zip(orm_found, trigram_found))
+        style = self.style.SUCCESS if not mismatches else self.style.ERROR
+        self.stdout.write(style(f"Расхождений в результатах: {mismatches} из {len(queries)}."))
+
+    def _generate(self, rnd: Random, words: List[str], count: int) -> None:
+        # Частоты слов убывают по закону Ципфа, как в обычном тексте.
+        weights = [1 / rank for rank in range(1, len(words) + 1)]
+        authors = User.objects.bulk_create(User(username=f"bench_{i}_{rnd.choice(WORDS)}") for i in range(50))
+        sections = [section for section, _ in Sections.Sections]
+        Topic.objects.bulk_create(
+            (Topic(
+                author=rnd.choice(authors),
+                title=" ".join(rnd.choices(words, weights, k=4)),
+                question=" ".join(rnd.choices(words, weights, k=rnd.randint(10, 120))),
+                section=rnd.choice(sections),
+            ) for _ in range(count)),
+            batch_size=1000,
+        )
+
+    def _get_queries(self, rnd: Random, words: List[str], count: int) -> List[Tuple[List[str], Sequence[str]]]:
+        fields = list(SearchParamsExpressions.Params.values())
+        return [([word[:rnd.randint(3, len(word))] for word in rnd.sample(words, rnd.randint(1, 2))],
+                 rnd.sample(fields, rnd.randint(1, len(fields))))
+                for _ in range(count)]
+
+    def _measure(self, backend: BaseSearchBackend,
+                 queries: List[Tuple[List[str], Sequence[str]]]) -> Tuple[List[float], List[Set[int]]]:
+        timings, found = list(), list()
+        for terms, fields in queries:
+            started = perf_counter()
+            queryset = backend.filter_queryset(Topic.objects.all(), terms, fields)
+            found.append(set(queryset.values_list("pk", flat=True)))
+            timings.append((perf_counter() - started) * 1000)
+        return timings, found
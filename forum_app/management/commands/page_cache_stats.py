@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandParser
+
+from services.page_cache import get_page_cache_stats, reset_page_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Выводит количество попаданий и промахов кэша страниц форума для анонимных читателей."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--reset", action="store_true", help="Обнулить счетчики после вывода.")
+
+    def handle(self, *args, **options) -> None:
+        for view_name, stats in get_page_cache_stats().items():
+            total = stats.hits + stats.misses
+            ratio = stats.hits / total * 100 if total else 0
+            self.stdout.write(f"{view_name}: попаданий - {stats.hits}, промахов - {stats.misses} ({ratio:.1f}%).")
+        if options["reset"]:
+            reset_page_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Счетчики обнулены."))
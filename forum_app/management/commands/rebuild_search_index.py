@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from services.search_backends import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Полностью перестраивает индекс текущего поискового бэкенда тем (FORUM_SEARCH_BACKEND)."
+
+    def handle(self, *args, **options) -> None:
+        backend = get_search_backend()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"{backend.__class__.__name__}: проиндексировано тем - {count}."))
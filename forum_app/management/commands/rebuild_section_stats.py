@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from forum_app.models import SectionStats, Topic
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает статистику разделов форума (SectionStats), количество комментариев "
+            "и последнюю активность тем по таблицам тем и комментариев.")
+
+    def handle(self, *args, **options) -> None:
+        self.stdout.write(f"Обновлено тем: {Topic.objects.rebuild_activity()}.")
+        for stats in SectionStats.objects.rebuild():
+            self.stdout.write(f"{stats.section}: тем - {stats.topics_count}, комментариев - {stats.comments_count}.")
+        self.stdout.write(self.style.SUCCESS("Статистика разделов пересчитана."))
@@ -1,39 +1,111 @@
-from os import remove
-from typing import Literal
+import os
+from datetime import datetime
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Literal, Optional, Type
+from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinLengthValidator
-from django.db import models
-from django.db.models import QuerySet
+from django.db import connections, models, router, transaction
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.backends.ddl_references import Statement
+from django.db.models import Count, F, Max, OuterRef, Q, QuerySet, Subquery, Sum, Value
 from django.db.models.fields.files import ImageFieldFile
-from django.db.models.signals import pre_delete
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch.dispatcher import receiver
 from django.urls import reverse
+from django.utils import timezone
 
 from forum_app.constants import Sections
-from schemora.settings.helpers import get_upload_crop_path
+from schemora.settings.helpers import get_versioned_path
+from tasks.forum_app_tasks import delete_upload_files
+
+
+def schedule_upload_deletion(names: Iterable[Optional[str]]) -> Literal[None]:
+    """
+    Удаление файлов вложений (исходных и их вариантов) Celery таской пакетами по UPLOADS_DELETE_BATCH_SIZE
+    после фиксации транзакции удаления: при ее откате файлы остаются.
+    """
+
+    names, size = [name for name in names if name], settings.UPLOADS_DELETE_BATCH_SIZE
+    for start in range(0, len(names), size):
+        transaction.on_commit(partial(delete_upload_files.delay, names[start:start + size]))
+    return None
 
 
 def _delete_upload(upload: ImageFieldFile | Literal[None]) -> Literal[None]:
-    if upload:
-        remove(get_upload_crop_path(upload.path))
-        upload.delete(False)
+    return schedule_upload_deletion((upload.name,) if upload else ())
 
 
-def get_image_link(upload: ImageFieldFile | Literal[None]) -> str | Literal[None]:
+def get_image_link(upload: ImageFieldFile | str | Literal[None], version: Optional[str] = None) \
+        -> str | Literal[None]:
+    """
+    Ссылка на загруженный файл с версией его содержимого. Версия загрузки модели по умолчанию
+    берется из поля <поле загрузки>_version ее объекта.
+    """
+
+    if isinstance(upload, str):
+        # Путь файла относительно MEDIA_ROOT (например, аватар из закэшированных настроек).
+        return get_versioned_path(settings.MEDIA_URL + upload, version) if upload else None
+    if version is None and upload is not None:
+        version = getattr(upload.instance, f"{upload.field.name}_version", None)
     try:
-        return settings.MEDIA_URL + upload.path.split(settings.MEDIA_ROOT)[-1]
+        return get_versioned_path(settings.MEDIA_URL + upload.path.split(settings.MEDIA_ROOT)[-1], version)
     except ValueError:
         return None
 
 
+# Префикс временного имени вложения объекта, еще не сохраненного в базе (без первичного ключа).
+TEMPORARY_UPLOAD_PREFIX = "tmp_"
+
+
+def _get_upload_name(directory: str, instance: 'Topic | Comment', filename: str) -> str:
+    name = instance.pk if instance.pk is not None else f"{TEMPORARY_UPLOAD_PREFIX}{uuid4().hex}"
+    return f"{directory}/{name}.{filename.split('.')[-1]}"
+
+
 def process_topic_upload(instance: 'Topic', filename: str) -> str:
-    return f"{settings.CUSTOM_TOPIC_UPLOADS_DIR}/{instance.pk}.{filename.split('.')[-1]}"
+    return _get_upload_name(settings.CUSTOM_TOPIC_UPLOADS_DIR, instance, filename)
 
 
 def process_comment_upload(instance: 'Comment', filename: str) -> str:
-    return f"{settings.CUSTOM_COMMENT_UPLOADS_DIR}/{instance.pk}.{filename.split('.')[-1]}"
+    return _get_upload_name(settings.CUSTOM_COMMENT_UPLOADS_DIR, instance, filename)
+
+
+def rename_temporary_upload(instance: 'Topic | Comment') -> bool:
+    """
+    Переименование вложения, сохраненного вместе с новым объектом под временным именем, в имя
+    по первичному ключу (process_topic_upload, process_comment_upload). Вызывается после фиксации
+    транзакции создания объекта. Имя в базе меняется UPDATE без сигналов сохранения, поэтому
+    версии закэшированных страниц с объектом меняет вызывающий код. Возвращает True, если имя изменилось.
+    """
+
+    upload = instance.upload
+    if not upload or not os.path.basename(upload.name).startswith(TEMPORARY_UPLOAD_PREFIX):
+        return False
+    name = upload.field.generate_filename(instance, upload.name)
+    # Если файл уже переименован, а имя в базе нет (сбой между ними), остается обновить только базу.
+    if upload.storage.exists(upload.name) or not upload.storage.exists(name):
+        name = upload.storage.get_available_name(name)
+        os.replace(upload.storage.path(upload.name), upload.storage.path(name))
+    type(instance).objects.filter(pk=instance.pk).update(upload=name)
+    upload.name = name
+    return True
+
+
+def get_temporary_upload_objects(added_before: datetime) -> Iterator['Topic | Comment']:
+    """
+    Темы и комментарии, добавленные до added_before, вложения которых остались под временным именем:
+    процесс завершился между фиксацией транзакции создания и rename_temporary_upload.
+    """
+
+    lookups = {"upload__contains": f"/{TEMPORARY_UPLOAD_PREFIX}", "time_added__lt": added_before}
+    yield from Topic.objects.filter(**lookups).order_by("pk").iterator()
+    yield from Comment.objects.filter(**lookups).order_by("pk").iterator()
 
 
 class Comment(models.Model):
@@ -41,10 +113,16 @@ class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     comment = models.CharField(validators=[MinLengthValidator(5)], max_length=2048)
     upload = models.ImageField(upload_to=process_comment_upload, null=True)
+    # Версия содержимого вложения для его URL (services.image_variants).
+    upload_version = models.CharField(max_length=16, blank=True, default="", editable=False)
     time_added = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ("time_added",)
+        indexes = (
+            models.Index(fields=("-time_added",), name="comment_time_added_idx"),
+            models.Index(fields=("topic", "-time_added"), name="comment_topic_time_added_idx"),
+        )
 
     def __str__(self):
         return f"{self.topic} comment by {self.author}."
@@ -53,17 +131,136 @@ class Comment(models.Model):
         return get_image_link(self.upload)
 
 
+def _delete_topic_comments(topic_id: int, using: str) -> int:
+    """
+    Удаление всех комментариев темы одним DELETE без загрузки объектов и сигналов удаления:
+    QuerySet.delete() при подключенных обработчиках удаления загружает каждый комментарий.
+    Возвращает количество удаленных комментариев.
+    """
+
+    connection = connections[using]
+    table = connection.ops.quote_name(Comment._meta.db_table)
+    column = connection.ops.quote_name(Comment._meta.get_field("topic").column)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {column} = %s", [topic_id])
+        return cursor.rowcount
+
+
+class SearchVectorIndex(GinIndex):
+    """ GIN индекс tsvector столбца. На других СУБД (dev, CI) создается обычным индексом. """
+
+    def create_sql(self, model: Type[models.Model], schema_editor: BaseDatabaseSchemaEditor,
+                   using: str = "", **kwargs) -> Statement:
+        if schema_editor.connection.vendor != "postgresql":
+            return models.Index.create_sql(self, model, schema_editor, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
+class TopicManager(models.Manager['Topic']):
+    def get_queryset(self) -> QuerySet['Topic']:
+        # search_vector нужен только базе данных, поэтому не загружается вместе с темами.
+        return super().get_queryset().defer("search_vector")
+
+    def add_comment(self, comment: Comment) -> Literal[None]:
+        """ Атомарное обновление счетчика комментариев и последней активности темы нового комментария. """
+
+        self.filter(pk=comment.topic_id).update(
+            comments_count=F("comments_count") + 1,
+            last_activity_at=Greatest(F("last_activity_at"), Value(comment.time_added)),
+        )
+        topic = self._get_loaded_topic(comment)
+        if topic:
+            topic.comments_count += 1
+            topic.last_activity_at = max(topic.last_activity_at, comment.time_added)
+        return None
+
+    def remove_comment(self, comment: Comment) -> Literal[None]:
+        self.filter(pk=comment.topic_id).update(
+            comments_count=Greatest(F("comments_count") - 1, Value(0)),
+            last_activity_at=Coalesce(self._get_last_comment_time(), F("time_added")),
+        )
+        topic = self._get_loaded_topic(comment)
+        if topic:
+            topic.comments_count = max(topic.comments_count - 1, 0)
+        return None
+
+    def delete_with_comments(self, topic: 'Topic') -> Literal[None]:
+        """
+        Удаление темы со всеми комментариями. Комментарии удаляются одним DELETE без сигналов удаления,
+        поэтому статистика раздела изменяется одним UPDATE, а файлы их вложений удаляются таской.
+        Тема удаляется обычно, ее сигналы меняют версии кэшей страниц (services.topic_fragments, page_cache).
+        Подсчет и удаление комментариев идут под блокировкой строки темы: комментарий, добавляемый
+        параллельно, ждет ее и не удаляется без учета в статистике раздела.
+        """
+
+        comments = Comment.objects.filter(topic=topic).order_by()
+        using = router.db_for_write(Comment)
+        with transaction.atomic(using=using):
+            locked = self.select_for_update().filter(pk=topic.pk).first()
+            if locked is None:
+                return None
+            totals = comments.aggregate(count=Count("pk"), last_time_added=Max("time_added"))
+            if totals["count"]:
+                schedule_upload_deletion(comments.exclude(upload="").exclude(upload__isnull=True)
+                                         .values_list("upload", flat=True))
+                _delete_topic_comments(topic.pk, using)
+                SectionStats.objects.remove_post(locked.section, totals["last_time_added"], is_topic=False,
+                                                 count=totals["count"])
+            topic.delete()
+        return None
+
+    def rebuild_activity(self) -> int:
+        """ Пересчет comments_count и last_activity_at всех тем по таблице комментариев. """
+
+        comments_count = (Comment.objects.filter(topic=OuterRef("pk")).order_by().values("topic")
+                          .annotate(count=Count("pk")).values("count"))
+        return self.update(
+            comments_count=Coalesce(Subquery(comments_count), Value(0)),
+            last_activity_at=Coalesce(self._get_last_comment_time(), F("time_added")),
+        )
+
+    @staticmethod
+    def _get_last_comment_time() -> Subquery:
+        return Subquery(Comment.objects.filter(topic=OuterRef("pk")).order_by("-time_added").values("time_added")[:1])
+
+    @staticmethod
+    def _get_loaded_topic(comment: Comment) -> Optional['Topic']:
+        """ Тема комментария, загруженная вместе со счетчиками, для обновления их значений без запроса. """
+
+        if not Comment.topic.is_cached(comment):
+            return None
+        topic = comment.topic
+        return None if {"comments_count", "last_activity_at"} & topic.get_deferred_fields() else topic
+
+
 class Topic(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="author")
     title = models.CharField(validators=[MinLengthValidator(8)], max_length=100)
     question = models.TextField(validators=[MinLengthValidator(5)], max_length=2048)
     upload = models.ImageField(upload_to=process_topic_upload, null=True)
+    # Версия содержимого вложения для его URL (services.image_variants).
+    upload_version = models.CharField(max_length=16, blank=True, default="", editable=False)
     section = models.CharField(choices=Sections.Sections, max_length=10, default=Sections.GENERAL)
     views = models.PositiveIntegerField(default=0)
     time_added = models.DateTimeField(auto_now_add=True)
+    # Денормализованные поля, обновляются при добавлении/удалении комментариев (TopicManager).
+    comments_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # Взвешенный tsvector (название > вопрос), обновляется поисковым бэкендом при сохранении темы.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = TopicManager()
 
     class Meta:
         ordering = ("-time_added",)
+        indexes = (
+            SearchVectorIndex(fields=("search_vector",), name="topic_search_vector_idx"),
+            models.Index(fields=("-time_added", "-id"), name="topic_time_added_idx"),
+            models.Index(fields=("section", "-time_added", "-id"), name="topic_section_time_added_idx"),
+            models.Index(fields=("author", "-time_added", "-id"), name="topic_author_time_added_idx"),
+            models.Index(fields=("-last_activity_at", "-id"), name="topic_last_activity_idx"),
+            models.Index(fields=("section", "-last_activity_at", "-id"), name="topic_section_activity_idx"),
+        )
 
     def __str__(self):
         return f"{self.author} topic about '{self.title}'"
@@ -77,7 +274,127 @@ class Topic(models.Model):
     @property
     def comments(self) -> QuerySet[Comment]:
         return (Comment.objects.select_related("author").only
-                ("author__username", "author__id", "comment", "upload", "time_added").filter(topic=self))
+                ("author__username", "author__id", "author__date_joined", "topic", "comment", "upload",
+                 "upload_version", "time_added")
+                .filter(topic=self))
+
+
+class SectionStatsManager(models.Manager['SectionStats']):
+    """
+    Менеджер денормализованной статистики разделов. Счетчики изменяются атомарными
+    UPDATE ... SET x = x + 1 в транзакции записи темы/комментария, без чтения строки.
+    """
+
+    def get_sections(self) -> Dict[str, 'SectionStats']:
+        """ Статистика всех разделов одним запросом. Недостающие строки достраиваются по таблицам тем. """
+
+        stats = {s.section: s for s in self.select_related("last_activity_user").only(
+            "section", "topics_count", "comments_count", "last_activity_at", "last_activity_user__username"
+        )}
+        if len(stats) < len(Sections.Sections):
+            self.rebuild()
+            return self.get_sections()
+        return stats
+
+    def get_totals(self) -> Dict[str, int]:
+        totals = self.aggregate(topics=Sum("topics_count"), comments=Sum("comments_count"), sections=Count("pk"))
+        if totals["sections"] < len(Sections.Sections):
+            self.rebuild()
+            return self.get_totals()
+        return totals
+
+    def add_post(self, section: Optional[str], author: User, time_added: datetime, is_topic: bool) -> Literal[None]:
+        counter = "topics_count" if is_topic else "comments_count"
+        with transaction.atomic():
+            self.filter(section=section).update(**{counter: F(counter) + 1})
+            self.filter(Q(last_activity_at__lte=time_added) | Q(last_activity_at__isnull=True),
+                        section=section).update(last_activity_at=time_added, last_activity_user=author)
+        return None
+
+    def remove_post(self, section: str, time_added: datetime, is_topic: bool, count: int = 1) -> Literal[None]:
+        """ Учет удаления count сообщений раздела, последнее из которых добавлено в time_added. """
+
+        counter = "topics_count" if is_topic else "comments_count"
+        with transaction.atomic():
+            self.filter(section=section).update(**{counter: Greatest(F(counter) - count, Value(0))})
+            # Удалено последнее сообщение раздела - последняя активность пересчитывается.
+            if self.filter(section=section, last_activity_at__lte=time_added).exists():
+                self.refresh_last_activity(section)
+        return None
+
+    def move_topic(self, topic: 'Topic', previous_section: str) -> Literal[None]:
+        comments = Comment.objects.filter(topic=topic).count()
+        with transaction.atomic():
+            self.filter(section=previous_section).update(
+                topics_count=Greatest(F("topics_count") - 1, Value(0)),
+                comments_count=Greatest(F("comments_count") - comments, Value(0)),
+            )
+            self.filter(section=topic.section).update(
+                topics_count=F("topics_count") + 1, comments_count=F("comments_count") + comments
+            )
+            self.refresh_last_activity(previous_section)
+            self.refresh_last_activity(topic.section)
+        return None
+
+    def refresh_last_activity(self, section: str) -> Literal[None]:
+        last_posts = [post for post in (
+            Topic.objects.filter(section=section).only("time_added", "author").order_by("-time_added").first(),
+            Comment.objects.filter(topic__section=section).only("time_added", "author")
+            .order_by("-time_added").first(),
+        ) if post is not None]
+        last_post = max(last_posts, key=lambda post: post.time_added, default=None)
+        self.filter(section=section).update(
+            last_activity_at=last_post.time_added if last_post else None,
+            last_activity_user=last_post.author_id if last_post else None,
+        )
+        return None
+
+    def rebuild(self) -> List['SectionStats']:
+        """ Полный пересчет статистики разделов по таблицам тем и комментариев. """
+
+        topics = dict(Topic.objects.order_by().values_list("section").annotate(Count("pk")))
+        comments = dict(Comment.objects.order_by().values_list("topic__section").annotate(Count("pk")))
+        with transaction.atomic():
+            stats = [self.update_or_create(section=section, defaults={
+                "topics_count": topics.get(section, 0), "comments_count": comments.get(section, 0)
+            })[0] for section, _ in Sections.Sections]
+            for section, _ in Sections.Sections:
+                self.refresh_last_activity(section)
+        return stats
+
+
+class SectionStats(models.Model):
+    """ Количество тем и комментариев раздела и его последняя активность для главной страницы форума. """
+
+    section = models.CharField(choices=Sections.Sections, max_length=10, primary_key=True)
+    topics_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True)
+    last_activity_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="+")
+
+    objects = SectionStatsManager()
+
+    def __str__(self):
+        return f"{self.section} stats"
+
+
+class TopicViewsFlush(models.Model):
+    """
+    Отметка последнего переноса буфера просмотров в базу. Записывается в одной транзакции с просмотрами,
+    поэтому повторный перенос того же буфера (после сбоя до его удаления из Redis) пропускается.
+    """
+
+    flush_id = models.CharField(max_length=32, unique=True)
+    time_added = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.flush_id
+
+
+def _get_comment_section(comment: Comment) -> Optional[str]:
+    if Comment.topic.is_cached(comment):
+        return comment.topic.section
+    return Topic.objects.filter(pk=comment.topic_id).values_list("section", flat=True).first()
 
 
 @receiver(pre_delete, sender=Topic)
@@ -88,3 +405,49 @@ def topic_upload_delete(sender, instance, **kwargs):
 @receiver(pre_delete, sender=Comment)
 def comment_upload_delete(sender, instance, **kwargs):
     _delete_upload(instance.upload)
+
+
+@receiver(pre_save, sender=Topic)
+@receiver(pre_delete, sender=Topic)
+def topic_stats_remember_section(sender: Type[Topic], instance: Topic, update_fields: Optional[List[str]] = None,
+                                 **kwargs) -> Literal[None]:
+    """
+    Запоминает раздел, в котором тема учтена в SectionStats: до сохранения формы
+    (AddInstanceMixin) раздел экземпляра может уже отличаться от сохраненного в базе.
+    """
+
+    if instance._state.adding or (update_fields is not None and "section" not in update_fields):
+        return None
+    instance.__dict__["_stats_section"] = Topic.objects.filter(pk=instance.pk).values_list("section", flat=True).first()
+
+
+@receiver(post_save, sender=Topic)
+def topic_stats_add(sender: Type[Topic], instance: Topic, created: bool, **kwargs) -> Literal[None]:
+    if created:
+        SectionStats.objects.add_post(instance.section, instance.author, instance.time_added, is_topic=True)
+        return None
+    previous_section = instance.__dict__.pop("_stats_section", None)
+    if previous_section and previous_section != instance.section:
+        SectionStats.objects.move_topic(instance, previous_section)
+
+
+@receiver(post_delete, sender=Topic)
+def topic_stats_remove(sender: Type[Topic], instance: Topic, **kwargs) -> Literal[None]:
+    section = instance.__dict__.pop("_stats_section", None) or instance.section
+    SectionStats.objects.remove_post(section, instance.time_added, is_topic=True)
+
+
+@receiver(post_save, sender=Comment)
+def comment_stats_add(sender: Type[Comment], instance: Comment, created: bool, **kwargs) -> Literal[None]:
+    if created:
+        Topic.objects.add_comment(instance)
+        SectionStats.objects.add_post(_get_comment_section(instance), instance.author, instance.time_added,
+                                      is_topic=False)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_stats_remove(sender: Type[Comment], instance: Comment, **kwargs) -> Literal[None]:
+    section = _get_comment_section(instance)
+    if section:
+        Topic.objects.remove_comment(instance)
+        SectionStats.objects.remove_post(section, instance.time_added, is_topic=False)
@@ -0,0 +1,18 @@
+from datetime import datetime
+from typing import Optional
+
+from django import template
+
+from services.timezones import TEMPLATE_DATETIME_FORMAT, get_timezone_formatter
+
+register = template.Library()
+
+
+@register.filter
+def user_datetime(value: Optional[datetime], timezone: Optional[str] = None) -> str:
+    """
+    Фильтр для вывода даты в зоне пользователя: {{ topic.time_added|user_datetime:tzone }}.
+    Пустая зона или 'Default' - зона по умолчанию.
+    """
+
+    return get_timezone_formatter(timezone or None).format(value, TEMPLATE_DATETIME_FORMAT) or ""
@@ -1,3 +1,117 @@
-from django.test import TestCase
+from typing import Literal, Type
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from forum_app.constants import Sections
+from forum_app.models import Comment, SectionStats, Topic
+from home_app.models import UserRating, UserSettings
+from schemora.cache import get_invalidation_bus
+from services.forum_stats import get_forum_stats
+from services.views_buffer import get_views_buffer
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, FORUM_VIEWS_FLUSH_INTERVAL=60*60)
+class _TopicPageTestCase(TestCase):
+    """ Тема с несколькими страницами комментариев разных авторов. """
+
+    comments_count = 45
+    topic: Topic
+
+    @classmethod
+    def setUpTestData(cls) -> Literal[None]:
+        users = [User.objects.create_user(username=f"user_{i}", password="password") for i in range(5)]
+        for user in users:
+            UserSettings.objects.create(user=user, signature=f"signature {user.username}")
+            UserRating.objects.create(user=user)
+        cls.topic = Topic.objects.create(author=users[0], title="topic title", question="topic question",
+                                         section=Sections.GENERAL)
+        for i in range(cls.comments_count):
+            Comment.objects.create(topic=cls.topic, author=users[i % len(users)], comment=f"comment {i}")
+        SectionStats.objects.rebuild()
+
+    def setUp(self) -> Literal[None]:
+        get_views_buffer.cache_clear()
+        self.addCleanup(get_views_buffer.cache_clear)
+
+    def _reset_cache(self) -> Literal[None]:
+        # Настройки авторов берутся из пустых кэшей, сводка форума - из заполненного.
+        cache.clear()
+        get_invalidation_bus().clear_all()
+        get_forum_stats()
+
+
+@override_settings(FORUM_PAGE_CACHE_TIMEOUT=0)
+class TopicPageQueriesTestCase(_TopicPageTestCase):
+    """ Количество запросов страницы темы не должно зависеть от номера страницы комментариев. """
+
+    def test_queries_count_does_not_depend_on_offset(self) -> Literal[None]:
+        # Тема, страница комментариев и настройки их авторов: сводка форума берется из кэша.
+        for offset, expected_comments in ((0, 20), (20, 20), (40, 5)):
+            self._reset_cache()
+            with self.subTest(offset=offset), self.assertNumQueries(3):
+                response = self.client.get(self.topic.get_absolute_url(), {"offset": offset})
+            self.assertEqual(response.status_code, 200)
+            comments = response.context["page"].comments
+            self.assertEqual(len(comments), expected_comments)
+            self.assertEqual(next(iter(comments)), str(offset + 1))
+
+    def test_cached_fragments_are_invalidated_by_new_comment(self) -> Literal[None]:
+        self._reset_cache()
+        url, params = self.topic.get_absolute_url(), {"offset": 40}
+        self.client.get(url, params)
+        # Заголовок, страница комментариев и сводка форума берутся из кэша: остается тема.
+        with self.assertNumQueries(1):
+            response = self.client.get(url, params)
+        self.assertContains(response, "comment 44")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(topic=self.topic, author=self.topic.author, comment="new comment")
+        response = self.client.get(url, params)
+        self.assertContains(response, "new comment")
+        self.assertContains(response, "Сообщение #46")
+
+
+class DeleteTopicTestCase(_TopicPageTestCase):
+    def test_comments_are_deleted_without_per_comment_signals(self) -> Literal[None]:
+        deleted = list()
+
+        def on_comment_delete(sender: Type[Comment], instance: Comment, **kwargs) -> Literal[None]:
+            deleted.append(instance.pk)
+
+        post_delete.connect(on_comment_delete, sender=Comment, dispatch_uid="test_comment_delete")
+        self.addCleanup(post_delete.disconnect, sender=Comment, dispatch_uid="test_comment_delete")
+        with self.captureOnCommitCallbacks(execute=True):
+            Topic.objects.delete_with_comments(self.topic)
+
+        self.assertEqual(deleted, [])
+        self.assertFalse(Topic.objects.filter(pk=self.topic.pk).exists())
+        self.assertFalse(Comment.objects.filter(topic_id=self.topic.pk).exists())
+        stats = SectionStats.objects.get(section=Sections.GENERAL)
+        self.assertEqual((stats.topics_count, stats.comments_count), (0, 0))
+
+
+class AnonymousPageCacheTestCase(_TopicPageTestCase):
+    def test_anonymous_topic_page_is_cached_and_counted(self) -> Literal[None]:
+        self._reset_cache()
+        url = self.topic.get_absolute_url()
+        self.assertEqual(self.client.get(url)["X-Page-Cache"], "miss")
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertEqual(get_views_buffer().get_pending([self.topic.pk]), {self.topic.pk: 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(topic=self.topic, author=self.topic.author, comment="new comment")
+        self.assertEqual(self.client.get(url)["X-Page-Cache"], "miss")
+
+    def test_logged_in_pages_are_not_cached(self) -> Literal[None]:
+        self._reset_cache()
+        self.client.force_login(self.topic.author)
+        for _ in range(2):
+            self.assertNotIn("X-Page-Cache", self.client.get(reverse("forum_app:home")))
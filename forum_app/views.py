@@ -17,13 +17,16 @@ from services.forum_app_utils import (
     SomeSectionViewUtils,
     SomeUserTopicsViewUtils,
 )
+from services.page_cache import anonymous_page_cache, count_topic_view, get_forum_pages_version, get_topic_page_version
 
 
+@anonymous_page_cache(get_forum_pages_version)
 def forum_home_view(request: HttpRequest) -> HttpResponse:
     context = ForumHomeViewUtils().forum_home_view_utils(request)
     return render(request, "forum/home.html", context=context)
 
 
+@anonymous_page_cache(get_forum_pages_version)
 def search_view(request: HttpRequest) -> HttpResponse:
     context = SearchViewUtils().search_view_utils(request)
     return render(request, "forum/search.html", context=context)
@@ -55,11 +58,13 @@ class AddCommentView(LoginRequiredMixin, View):
         return AddCommentViewUtils().add_comment_view_post_utils(self, request, section, ids)
 
 
+@anonymous_page_cache(get_topic_page_version, on_hit=count_topic_view)
 def some_id_view(request: HttpRequest, section: str, ids: int) -> HttpResponse:
     context = SomeIdUtils().some_id_view_utils(request, section, ids)
     return render(request, "forum/some_id.html", context=context)
 
 
+@anonymous_page_cache(get_forum_pages_version)
 def some_section_view(request: HttpRequest, section: str) -> HttpResponse:
     context = SomeSectionViewUtils().some_section_view_utils(request, section)
     return render(request, "forum/some_header.html", context=context)
@@ -4,3 +4,9 @@ accesslog = "/Omenforcer/log/access.log"
 errorlog = "/Omenforcer/log/error.log"
 capture_output = True
 loglevel = "info"
+
+
+def post_worker_init(worker: object) -> None:
+    # Индексы поисковых бэкендов в памяти процесса строятся до первого запроса к воркеру.
+    from services.search_backends import get_search_backend
+    get_search_backend().warm_up()
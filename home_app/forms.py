@@ -8,6 +8,7 @@ from django.forms import PasswordInput, TextInput
 
 from forum.settings import BASE_DIR, CUSTOM_USER_AVATARS_DIR, MEDIA_ROOT
 from schemora.settings.helpers import get_user_settings_model
+from services.image_variants import validate_image_pixels
 
 UserSettings = get_user_settings_model()
 
@@ -42,6 +43,7 @@ class UploadAvatarForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["avatar"].required, self.fields["avatar"].label = False, "Ваш аватар:"
+        self.fields["avatar"].validators.append(validate_image_pixels)
         self.fields["avatar"].widget = forms.ClearableFileInput(attrs={
             'style': 'background-color: rgb(20, 20, 20); color: rgb(204, 204, 204)'
         })
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from home_app.models import UserRating
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает рейтинг, количество отзывов, лайков и дизлайков пользователей (UserRating) "
+            "по таблице отзывов одним GROUP BY.")
+
+    def handle(self, *args, **options) -> None:
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано рейтингов: {UserRating.objects.rebuild()}."))
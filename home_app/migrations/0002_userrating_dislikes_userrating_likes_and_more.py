@@ -0,0 +1,53 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:15
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_rating_counters(apps, schema_editor):
+    """
+    Заполнение новых счетчиков рейтинга по таблице отзывов (как UserRatingManager.rebuild):
+    с нулевыми счетчиками первое снятие отзыва уменьшило бы PositiveIntegerField ниже нуля.
+    """
+
+    Review = apps.get_model("home_app", "Review")
+    UserRating = apps.get_model("home_app", "UserRating")
+    counters = {row.pop("user"): row for row in Review.objects.order_by().values("user").annotate(
+        reviews_count=Count("pk"), likes=Count("pk", filter=Q(feedback=True)),
+        dislikes=Count("pk", filter=Q(feedback=False)),
+    )}
+    ratings = list(UserRating.objects.all())
+    created = [UserRating(user_id=user_id) for user_id in set(counters) - {r.user_id for r in ratings}]
+    for rating in (*ratings, *created):
+        row = counters.get(rating.user_id, dict())
+        rating.reviews_count, rating.likes, rating.dislikes = (row.get(counter, 0) for counter in
+                                                               ("reviews_count", "likes", "dislikes"))
+        rating.rating = rating.likes - rating.dislikes
+    UserRating.objects.bulk_update(ratings, ("rating", "reviews_count", "likes", "dislikes"), batch_size=1000)
+    UserRating.objects.bulk_create(created, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userrating',
+            name='dislikes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userrating',
+            name='likes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userrating',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_counters, migrations.RunPython.noop),
+    ]
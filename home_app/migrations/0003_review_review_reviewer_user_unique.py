@@ -0,0 +1,54 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def delete_duplicate_reviews(apps, schema_editor):
+    """
+    Удаление повторных отзывов перед добавлением ограничения уникальности: от каждого рецензента
+    на пользователя остается последний отзыв. Счетчики рейтинга затронутых пользователей пересчитываются
+    (как UserRatingManager.rebuild), потому что повторные отзывы входили в них.
+    """
+
+    Review = apps.get_model("home_app", "Review")
+    UserRating = apps.get_model("home_app", "UserRating")
+    duplicates = (Review.objects.order_by().values("reviewer", "user").annotate(count=Count("pk"))
+                  .filter(count__gt=1))
+    stale_ids, user_ids = list(), set()
+    for pair in duplicates:
+        reviews = Review.objects.filter(reviewer=pair["reviewer"], user=pair["user"]).order_by("-time_added", "-pk")
+        stale_ids += list(reviews.values_list("pk", flat=True)[1:])
+        user_ids.add(pair["user"])
+    if not stale_ids:
+        return
+    for start in range(0, len(stale_ids), 1000):
+        Review.objects.filter(pk__in=stale_ids[start:start + 1000]).delete()
+
+    counters = {row.pop("user"): row for row in Review.objects.order_by().filter(user__in=user_ids).values("user")
+                .annotate(reviews_count=Count("pk"), likes=Count("pk", filter=Q(feedback=True)),
+                          dislikes=Count("pk", filter=Q(feedback=False)))}
+    ratings = list(UserRating.objects.filter(user__in=user_ids))
+    created = [UserRating(user_id=user_id) for user_id in user_ids - {r.user_id for r in ratings}]
+    for rating in (*ratings, *created):
+        row = counters.get(rating.user_id, dict())
+        rating.reviews_count, rating.likes, rating.dislikes = (row.get(counter, 0) for counter in
+                                                               ("reviews_count", "likes", "dislikes"))
+        rating.rating = rating.likes - rating.dislikes
+    UserRating.objects.bulk_update(ratings, ("rating", "reviews_count", "likes", "dislikes"), batch_size=1000)
+    UserRating.objects.bulk_create(created, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home_app', '0002_userrating_dislikes_userrating_likes_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_reviews, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.UniqueConstraint(fields=('reviewer', 'user'), name='review_reviewer_user_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home_app', '0003_review_review_reviewer_user_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersettings',
+            name='avatar_version',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+    ]
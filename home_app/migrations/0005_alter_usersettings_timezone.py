@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home_app', '0004_usersettings_avatar_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usersettings',
+            name='timezone',
+            field=models.CharField(default='UTC', max_length=30),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+def fill_empty_signatures(apps, schema_editor):
+    """ Пустые подписи (NULL) заменяются пустой строкой: иначе столбец не станет NOT NULL. """
+
+    UserSettings = apps.get_model("home_app", "UserSettings")
+    UserSettings.objects.filter(signature__isnull=True).update(signature="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home_app', '0005_alter_usersettings_timezone'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_empty_signatures, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='usersettings',
+            name='signature',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
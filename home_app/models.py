@@ -1,12 +1,15 @@
+from typing import Dict, Iterable, Literal, Mapping, Optional
+
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Q
 
 from schemora.conf import schemora_settings
 
 
 def process_upload_user_avatar(instance: 'UserSettings', filename: str) -> str:
-    return f"{settings.CUSTOM_USER_AVATARS_DIR}/{instance.user.pk}/{instance.user.pk}.{filename.split('.')[-1]}"
+    return f"{settings.CUSTOM_USER_AVATARS_DIR}/{instance.user_id}/{instance.user_id}.{filename.split('.')[-1]}"
 
 
 class UserSettings(models.Model):
@@ -16,12 +19,54 @@ class UserSettings(models.Model):
     timezone = models.CharField(max_length=30, default=schemora_settings.USER_SETTINGS.DEFAULT_USER_TIMEZONE)
     avatar = models.ImageField(upload_to=process_upload_user_avatar,
                                default=schemora_settings.USER_SETTINGS.DEFAULT_USER_AVATAR_FILENAME)
+    # Версия содержимого аватара для его URL (services.image_variants). У аватара по умолчанию пустая.
+    avatar_version = models.CharField(max_length=16, blank=True, default="", editable=False)
     signature = models.CharField(max_length=64, blank=True, default="")
 
     def __str__(self):
         return f"{self.user} settings."
 
 
+class ReviewManager(models.Manager['Review']):
+    """
+    Менеджер отзывов. Отзывы на одного пользователя изменяются по очереди: транзакция блокирует строку
+    пользователя (SELECT ... FOR UPDATE), читает прежний отзыв и пишет новый одним INSERT ... ON CONFLICT
+    вместе с изменением счетчиков рейтинга. Поэтому параллельные лайки и дизлайки не создают дубликатов,
+    а счетчики изменяются на разницу с действительно прежним отзывом.
+    """
+
+    def upsert(self, reviewer: User, user: User, like: Optional[bool]) -> bool:
+        """ Лайк (like=True) или дизлайк пользователя. Возвращает False, если такой отзыв уже есть. """
+
+        with transaction.atomic():
+            previous = self._lock_and_get_previous(reviewer, user)
+            feedback = previous["feedback"] if previous is not None else None
+            if previous is not None and feedback == like:
+                return False
+            self.bulk_create((Review(reviewer=reviewer, user=user, feedback=like),), update_conflicts=True,
+                             unique_fields=("reviewer", "user"), update_fields=("feedback", "time_added"))
+            UserRating.objects.update_counters(user, reviews=int(previous is None),
+                                               likes=(like is True) - (feedback is True),
+                                               dislikes=(like is False) - (feedback is False))
+        return True
+
+    def drop(self, reviewer: User, user: User) -> bool:
+        """ Удаление отзыва. Возвращает False, если отзыва нет. """
+
+        with transaction.atomic():
+            previous = self._lock_and_get_previous(reviewer, user)
+            if previous is None:
+                return False
+            self.filter(reviewer=reviewer, user=user).delete()
+            UserRating.objects.update_counters(user, reviews=-1, likes=-(previous["feedback"] is True),
+                                               dislikes=-(previous["feedback"] is False))
+        return True
+
+    def _lock_and_get_previous(self, reviewer: User, user: User) -> Optional[Mapping[str, object]]:
+        User.objects.select_for_update().filter(pk=user.pk).values_list("pk").get()
+        return self.filter(reviewer=reviewer, user=user).values("feedback").first()
+
+
 class Review(models.Model):
     """ Модель отзывов на пользователей. """
 
@@ -30,15 +75,83 @@ class Review(models.Model):
     feedback = models.BooleanField(null=True)
     time_added = models.DateTimeField(auto_now=True)
 
+    objects = ReviewManager()
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=("reviewer", "user"), name="review_reviewer_user_unique"),
+        )
+
     def __str__(self):
         return f"{self.reviewer} review on {self.user}."
 
 
+class UserRatingManager(models.Manager['UserRating']):
+    """
+    Менеджер рейтинга пользователей. Количество отзывов, лайков и дизлайков хранится в строке рейтинга
+    и изменяется атомарным UPDATE вместе с записью отзыва, поэтому для их чтения не нужны COUNT по отзывам.
+    """
+
+    counters = ("reviews_count", "likes", "dislikes")
+
+    def get_for_user(self, user: User) -> 'UserRating':
+        """ Рейтинг пользователя одним запросом. Отсутствующая строка достраивается по отзывам. """
+
+        rating = self.filter(user=user).first()
+        if rating is None:
+            self.rebuild(users=[user])
+            return self.get_for_user(user)
+        return rating
+
+    def update_counters(self, user: User, reviews: int = 0, likes: int = 0, dislikes: int = 0) -> Literal[None]:
+        """ Изменение счетчиков на переданные разницы. Вызывается в транзакции записи отзыва. """
+
+        updated = self.filter(user=user).update(
+            rating=F("rating") + likes - dislikes, reviews_count=F("reviews_count") + reviews,
+            likes=F("likes") + likes, dislikes=F("dislikes") + dislikes,
+        )
+        if not updated:
+            self.rebuild(users=[user])
+        return None
+
+    def rebuild(self, users: Optional[Iterable[User]] = None) -> int:
+        """
+        Пересчет счетчиков по таблице отзывов одним GROUP BY (для всех пользователей или только для users).
+        Недостающие строки рейтинга создаются. Возвращает количество пересчитанных строк.
+        """
+
+        reviews, ratings = Review.objects.order_by(), self.all()
+        if users is not None:
+            user_ids = [user.pk for user in users]
+            reviews, ratings = reviews.filter(user__in=user_ids), ratings.filter(user__in=user_ids)
+        counters = {row.pop("user"): row for row in reviews.values("user").annotate(
+            reviews_count=Count("pk"), likes=Count("pk", filter=Q(feedback=True)),
+            dislikes=Count("pk", filter=Q(feedback=False)),
+        )}
+        with transaction.atomic():
+            locked = list(ratings.select_for_update())
+            missing = (set(counters) | set(user_ids if users is not None else ())) - {r.user_id for r in locked}
+            created = [self.model(user_id=user_id) for user_id in missing]
+            for rating in (*locked, *created):
+                row = counters.get(rating.user_id, dict())
+                for counter in self.counters:
+                    setattr(rating, counter, row.get(counter, 0))
+                rating.rating = rating.likes - rating.dislikes
+            self.bulk_update(locked, ("rating", *self.counters), batch_size=1000)
+            self.bulk_create(created)
+        return len(locked) + len(created)
+
+
 class UserRating(models.Model):
     """ Модель рейтинга конкретного камрада. """
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     rating = models.IntegerField(default=0)
+    reviews_count = models.PositiveIntegerField(default=0)
+    likes = models.PositiveIntegerField(default=0)
+    dislikes = models.PositiveIntegerField(default=0)
+
+    objects = UserRatingManager()
 
     def __str__(self):
         return f"{self.user} rating is {self.rating}."
@@ -1,3 +1,69 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Barrier
+from typing import Callable, List, Literal, Sequence
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import TransactionTestCase, skipUnlessDBFeature
+
+from home_app.models import Review, UserRating
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentReviewsTestCase(TransactionTestCase):
+    """
+    Параллельные лайки, дизлайки и удаления отзывов не создают дубликатов отзывов
+    и не сбивают счетчики рейтинга. Нужна СУБД с SELECT ... FOR UPDATE (PostgreSQL).
+    """
+
+    threads = 8
+
+    def setUp(self) -> Literal[None]:
+        self.user = User.objects.create_user(username="user", password="password")
+        self.reviewers = [User.objects.create_user(username=f"reviewer_{i}", password="password") for i in range(2)]
+        UserRating.objects.create(user=self.user)
+
+    def _run_in_threads(self, operations: Sequence[Callable[[], bool]]) -> List[bool]:
+        barrier = Barrier(len(operations))
+
+        def run(operation: Callable[[], bool]) -> bool:
+            barrier.wait()
+            try:
+                return operation()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(len(operations)) as pool:
+            return list(pool.map(run, operations))
+
+    def _assert_rating_matches_reviews(self) -> Literal[None]:
+        reviews = Review.objects.filter(user=self.user).aggregate(
+            reviews_count=Count("pk"), likes=Count("pk", filter=Q(feedback=True)),
+            dislikes=Count("pk", filter=Q(feedback=False)),
+        )
+        rating = UserRating.objects.get(user=self.user)
+        self.assertEqual(
+            (rating.reviews_count, rating.likes, rating.dislikes, rating.rating),
+            (reviews["reviews_count"], reviews["likes"], reviews["dislikes"], reviews["likes"] - reviews["dislikes"]),
+        )
+
+    def test_parallel_likes_create_one_review(self) -> Literal[None]:
+        reviewer = self.reviewers[0]
+        results = self._run_in_threads([partial(Review.objects.upsert, reviewer, self.user, True)] * self.threads)
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Review.objects.filter(reviewer=reviewer, user=self.user).count(), 1)
+        self._assert_rating_matches_reviews()
+
+    def test_parallel_likes_dislikes_and_drops_keep_rating_consistent(self) -> Literal[None]:
+        operations = list()
+        for i in range(self.threads * 2):
+            reviewer = self.reviewers[i % len(self.reviewers)]
+            operations.append((partial(Review.objects.upsert, reviewer, self.user, True),
+                               partial(Review.objects.upsert, reviewer, self.user, False),
+                               partial(Review.objects.drop, reviewer, self.user))[i % 3])
+        self._run_in_threads(operations)
+        for reviewer in self.reviewers:
+            self.assertLessEqual(Review.objects.filter(reviewer=reviewer, user=self.user).count(), 1)
+        self._assert_rating_matches_reviews()
@@ -1,7 +1,33 @@
-from schemora.cache.cache import get_cache_name_delimiter, get_user_settings_cache_name, get_user_settings_cache_timeout
+from schemora.cache.cache import (
+    get_cache_name_delimiter,
+    get_local_cache_maxsize,
+    get_local_cache_timeout,
+    get_user_settings_cache_key,
+    get_user_settings_cache_keys,
+    get_user_settings_cache_name,
+    get_user_settings_cache_namespace,
+    get_user_settings_cache_timeout,
+    get_user_settings_local_cache,
+    invalidate_user_settings_cache,
+)
+from schemora.cache.clients import get_redis_client
+from schemora.cache.local import LocalCache, get_invalidation_bus, get_local_cache
+from schemora.cache.namespace import CacheNamespace
 
 __all__ = [
+    "CacheNamespace",
+    "LocalCache",
     "get_cache_name_delimiter",
+    "get_invalidation_bus",
+    "get_local_cache",
+    "get_local_cache_maxsize",
+    "get_local_cache_timeout",
+    "get_redis_client",
+    "get_user_settings_cache_key",
+    "get_user_settings_cache_keys",
     "get_user_settings_cache_name",
-    "get_user_settings_cache_timeout"
+    "get_user_settings_cache_namespace",
+    "get_user_settings_cache_timeout",
+    "get_user_settings_local_cache",
+    "invalidate_user_settings_cache",
 ]
@@ -1,3 +1,8 @@
+from functools import lru_cache
+from typing import Dict, Iterable, Literal
+
+from schemora.cache.local import LocalCache, get_local_cache
+from schemora.cache.namespace import CacheNamespace
 from schemora.conf import schemora_settings
 
 
@@ -8,3 +13,35 @@ def get_user_settings_cache_name() -> str: return schemora_settings.CACHE.USER_S
 
 
 def get_user_settings_cache_timeout() -> int: return schemora_settings.CACHE.USER_SETTINGS_CACHE_TIMEOUT
+
+
+def get_local_cache_maxsize() -> int: return schemora_settings.CACHE.LOCAL_CACHE_MAXSIZE
+
+
+def get_local_cache_timeout() -> int: return schemora_settings.CACHE.LOCAL_CACHE_TIMEOUT
+
+
+@lru_cache(maxsize=None)
+def get_user_settings_cache_namespace() -> CacheNamespace:
+    """ Пространство имен кэша настроек пользователей: сущность - id пользователя. """
+
+    return CacheNamespace(get_user_settings_cache_name(), delimiter=get_cache_name_delimiter())
+
+
+def get_user_settings_local_cache() -> LocalCache:
+    """ Кэш настроек пользователей в памяти процесса перед общим кэшем: ключ - id пользователя. """
+
+    return get_local_cache(get_user_settings_cache_name(), get_local_cache_maxsize(), get_local_cache_timeout())
+
+
+def get_user_settings_cache_key(user_id: int) -> str:
+    return get_user_settings_cache_namespace().make_key(user_id)
+
+
+def get_user_settings_cache_keys(user_ids: Iterable[int]) -> Dict[int, str]:
+    return get_user_settings_cache_namespace().make_keys(user_ids)
+
+
+def invalidate_user_settings_cache(user_id: int) -> Literal[None]:
+    get_user_settings_cache_namespace().invalidate(user_id)
+    return get_user_settings_local_cache().invalidate(user_id)
@@ -0,0 +1,17 @@
+from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+from redis import Redis
+
+
+def get_redis_client(cache: BaseCache, key: str, write: bool = True) -> Redis:
+    """
+    Клиент redis-py кэша с бэкендом RedisCache для команд, которых нет в API кэша Django
+    (HINCRBY, RENAME, PUBLISH). Django не отдает клиент публично, поэтому обращение
+    к внутреннему клиенту бэкенда собрано в этой функции. Для других бэкендов - ImproperlyConfigured.
+    """
+
+    if not isinstance(cache, RedisCache):
+        raise ImproperlyConfigured(f"Redis client requires the {RedisCache.__module__}.{RedisCache.__name__} "
+                                   f"cache backend, got {type(cache).__module__}.{type(cache).__name__}.")
+    return cache._cache.get_client(key, write=write)
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, Iterable, Literal, Mapping, Optional, Tuple, TypeVar, Union
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.redis import RedisCache
+from redis import Redis
+
+from schemora.cache.clients import get_redis_client
+from schemora.conf import schemora_settings
+
+logger = logging.getLogger(__name__)
+
+# Ключи передаются между процессами в JSON, поэтому это строки или числа.
+Key = Union[str, int]
+KeyT = TypeVar("KeyT", str, int)
+# Сообщение об инвалидации: имя локального кэша и ключ. Ключ None - очистка всего кэша.
+InvalidationMessage = Tuple[str, Optional[Key]]
+
+
+class LocalCache(object):
+    """
+    Ограниченный LRU кэш с TTL в памяти процесса (L1) перед общим кэшем (Redis) для небольших
+    часто читаемых объектов. Инвалидация записи рассылается шиной всем воркерам, а TTL ограничивает
+    устаревание записи, если сообщение шины потерялось.
+    """
+
+    def __init__(self, name: str, maxsize: int, timeout: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries: OrderedDict[Key, Tuple[float, object]] = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: Key, default: object = None) -> object:
+        get_invalidation_bus().ensure_listening()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def get_many(self, keys: Iterable[KeyT]) -> Dict[KeyT, object]:
+        marker = object()
+        values = ((key, self.get(key, marker)) for key in keys)
+        return {key: value for key, value in values if value is not marker}
+
+    def set(self, key: Key, value: object) -> Literal[None]:
+        if self.maxsize <= 0 or self.timeout <= 0:
+            return None
+        with self.lock:
+            self.entries[key] = (monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return None
+
+    def set_many(self, values: Mapping[KeyT, object]) -> Literal[None]:
+        for key, value in values.items():
+            self.set(key, value)
+        return None
+
+    def delete(self, key: Key) -> Literal[None]:
+        with self.lock:
+            self.entries.pop(key, None)
+        return None
+
+    def clear(self) -> Literal[None]:
+        with self.lock:
+            self.entries.clear()
+        return None
+
+    def invalidate(self, key: Optional[Key] = None) -> Literal[None]:
+        """ Удаление записи (или всего кэша при key=None) во всех процессах. """
+
+        get_invalidation_bus().publish((self.name, key))
+        return None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class BaseInvalidationBus(ABC):
+    """ Шина рассылки инвалидаций локальных кэшей всем процессам. """
+
+    def __init__(self):
+        self.caches: Dict[str, LocalCache] = dict()
+
+    def register(self, local_cache: LocalCache) -> LocalCache:
+        self.caches[local_cache.name] = local_cache
+        return local_cache
+
+    def dispatch(self, message: InvalidationMessage) -> Literal[None]:
+        name, key = message
+        local_cache = self.caches.get(name)
+        if local_cache is not None:
+            local_cache.clear() if key is None else local_cache.delete(key)
+        return None
+
+    def clear_all(self) -> Literal[None]:
+        for local_cache in self.caches.values():
+            local_cache.clear()
+        return None
+
+    @abstractmethod
+    def publish(self, message: InvalidationMessage) -> Literal[None]:
+        raise NotImplementedError()
+
+    def ensure_listening(self) -> Literal[None]:
+        """ Запуск получения сообщений в текущем процессе, если оно еще не запущено. """
+
+        return None
+
+
+class LocalInvalidationBus(BaseInvalidationBus):
+    """ Шина для окружений без Redis (dev, тесты): сообщения сразу применяются в текущем процессе. """
+
+    def publish(self, message: InvalidationMessage) -> Literal[None]:
+        return self.dispatch(message)
+
+
+class RedisInvalidationBus(BaseInvalidationBus):
+    """
+    Шина на Redis pub/sub. Каждый процесс слушает канал в фоновом потоке, который запускается
+    при первом чтении локального кэша (после fork'а воркера - заново). Пока соединение потеряно,
+    сообщения могут пропасть, поэтому при переподключении локальные кэши очищаются.
+    """
+
+    reconnect_delay = 1
+
+    def __init__(self, redis_cache: RedisCache, channel: str):
+        super().__init__()
+        self.cache = redis_cache
+        self.channel = channel
+        self.listener_pid: Optional[int] = None
+        self.lock = Lock()
+
+    @property
+    def client(self) -> Redis:
+        return get_redis_client(self.cache, self.channel)
+
+    def publish(self, message: InvalidationMessage) -> Literal[None]:
+        # Свой процесс очищается сразу, не дожидаясь сообщения из канала.
+        self.dispatch(message)
+        self.client.publish(self.channel, json.dumps(message))
+        return None
+
+    def ensure_listening(self) -> Literal[None]:
+        if self.listener_pid == os.getpid():
+            return None
+        with self.lock:
+            if self.listener_pid != os.getpid():
+                Thread(target=self._listen, name="schemora-cache-invalidation", daemon=True).start()
+                self.listener_pid = os.getpid()
+        return None
+
+    def _listen(self) -> Literal[None]:
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.clear_all()
+                for message in pubsub.listen():
+                    name, key = json.loads(message["data"])
+                    self.dispatch((name, key))
+            except Exception:
+                logger.exception("Local cache invalidation listener failed, reconnecting.")
+                self.clear_all()
+                sleep(self.reconnect_delay)
+
+
+@lru_cache(maxsize=None)
+def get_invalidation_bus() -> BaseInvalidationBus:
+    """ Функция для получения шины инвалидаций: Redis pub/sub, если Redis используется как кэш, иначе локальная. """
+
+    default_cache = caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(default_cache, RedisCache):
+        return RedisInvalidationBus(default_cache, schemora_settings.CACHE.LOCAL_CACHE_INVALIDATION_CHANNEL)
+    return LocalInvalidationBus()
+
+
+def get_local_cache(name: str, maxsize: int, timeout: float) -> LocalCache:
+    """ Функция для получения зарегистрированного в шине инвалидаций локального кэша. """
+
+    bus = get_invalidation_bus()
+    local_cache = bus.caches.get(name)
+    return local_cache if local_cache is not None else bus.register(LocalCache(name, maxsize, timeout))
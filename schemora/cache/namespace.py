@@ -0,0 +1,70 @@
+from time import time_ns
+from typing import Dict, Hashable, Iterable, Literal, TypeVar
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import BaseCache
+
+Entity = Hashable
+EntityT = TypeVar("EntityT", bound=Hashable)
+
+
+class CacheNamespace(object):
+    """
+    Пространство имен кэша с поколениями. Ключ записи сущности содержит номер ее поколения,
+    поэтому инвалидация всех записей сущности - один атомарный инкремент номера поколения,
+    без знания ключей самих записей. Записи старых поколений больше не читаются и вытесняются кэшем.
+    Новое поколение начинается со времени в наносекундах: вытесненный номер поколения
+    не может вернуться со значением, совпадающим с одним из прежних.
+    """
+
+    def __init__(self, name: str, delimiter: str = ":", alias: str = DEFAULT_CACHE_ALIAS):
+        self.name = name
+        self.delimiter = delimiter
+        self.alias = alias
+
+    @property
+    def cache(self) -> BaseCache:
+        return caches[self.alias]
+
+    def get_generation_key(self, entity: Entity = "") -> str:
+        return self.delimiter.join((self.name, "generation", str(entity)))
+
+    def get_generation(self, entity: Entity = "") -> int:
+        return self.get_generations((entity,))[entity]
+
+    def get_generations(self, entities: Iterable[EntityT]) -> Dict[EntityT, int]:
+        """ Номера поколений сущностей одним cache.get_many. Отсутствующие поколения создаются. """
+
+        keys = {self.get_generation_key(entity): entity for entity in entities}
+        generations = self.cache.get_many(keys.keys())
+        for key in keys.keys() - generations.keys():
+            generation = time_ns()
+            if not self.cache.add(key, generation, timeout=None):
+                generation = self.cache.get(key, generation)
+            generations[key] = generation
+        return {entity: generations[key] for key, entity in keys.items()}
+
+    def make_key(self, entity: Entity = "", *parts: str) -> str:
+        """ Ключ записи сущности в текущем поколении. parts различают несколько записей одной сущности. """
+
+        return self.make_keys((entity,), *parts)[entity]
+
+    def make_keys(self, entities: Iterable[EntityT], *parts: str) -> Dict[EntityT, str]:
+        return {entity: self.delimiter.join((self.name, str(entity), str(generation), *parts))
+                for entity, generation in self.get_generations(entities).items()}
+
+    def invalidate(self, entity: Entity = "") -> Literal[None]:
+        """ Инвалидация всех записей сущности. """
+
+        key = self.get_generation_key(entity)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # Поколение вытеснено: записи без поколения уже недоступны, начинается новое.
+            self.cache.add(key, time_ns(), timeout=None)
+        return None
+
+    def invalidate_many(self, entities: Iterable[Entity]) -> Literal[None]:
+        for entity in entities:
+            self.invalidate(entity)
+        return None
@@ -39,7 +39,10 @@ DEFAULTS = {
     "CACHE": {
         "USER_SETTINGS_CACHE_NAME": DependentSetting("USER_SETTINGS", "user_settings"),
         "USER_SETTINGS_CACHE_TIMEOUT": DependentSetting("USER_SETTINGS", 60),
-        "USER_DEFINED_CACHE_NAME_DELIMITER": OptionalSetting(":")
+        "USER_DEFINED_CACHE_NAME_DELIMITER": OptionalSetting(":"),
+        "LOCAL_CACHE_MAXSIZE": OptionalSetting(1024),
+        "LOCAL_CACHE_TIMEOUT": OptionalSetting(30),
+        "LOCAL_CACHE_INVALIDATION_CHANNEL": OptionalSetting("schemora:local_cache_invalidation"),
     },
 }
 
@@ -1,14 +1,30 @@
-from datetime import datetime
-from typing import Any, Dict, Tuple, Type, Union
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
+from datetime import datetime, tzinfo
+from datetime import timezone as dt_timezone
+from functools import lru_cache
+from typing import Dict, Iterable, Literal, NamedTuple, Optional, Tuple, Type, Union, cast
 
-import pytz
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
+from django.http import HttpRequest
 from django.utils.module_loading import import_string
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from schemora.cache import get_cache_name_delimiter, get_user_settings_cache_name, get_user_settings_cache_timeout
+from schemora.cache import (
+    get_user_settings_cache_key,
+    get_user_settings_cache_keys,
+    get_user_settings_cache_timeout,
+    get_user_settings_local_cache,
+    invalidate_user_settings_cache,
+)
 from schemora.conf import schemora_settings
+from schemora.settings.snapshot import (
+    UserSettingsSnapshot,
+    dump_user_settings_snapshot,
+    load_user_settings_snapshot,
+)
 
 User = get_user_model()
 
@@ -22,23 +38,151 @@ def get_user_settings_model() -> Type:
 UserSettings = get_user_settings_model()
 
 
-def get_user_settings(user: Union[User | AnonymousUser, UserSettings]) -> UserSettings:
-    """ Функция для получения объекта настроек пользователя. """
+# Поля модели, из которых строится UserSettingsSnapshot.
+USER_SETTINGS_SNAPSHOT_FIELDS = ("user_id", "timezone", "avatar", "avatar_version", "signature")
 
-    if isinstance(user, UserSettings):
+
+def make_user_settings_snapshot(user_settings: UserSettings) -> UserSettingsSnapshot:
+    return UserSettingsSnapshot(user_settings.user_id, user_settings.timezone, str(user_settings.avatar),
+                                user_settings.avatar_version, user_settings.signature)
+
+
+def get_user_settings(user: Union[User | AnonymousUser, UserSettings, UserSettingsSnapshot]) \
+        -> UserSettings | UserSettingsSnapshot:
+    """
+    Функция для получения настроек пользователя. По пользователю возвращаются настройки только для чтения
+    (UserSettingsSnapshot) из кэша процесса, общего кэша или базы.
+    """
+
+    if isinstance(user, (UserSettings, UserSettingsSnapshot)):
         return user
     elif isinstance(user, User):
-        settings_cache_name = f"{user.pk}{get_cache_name_delimiter()}{get_user_settings_cache_name()}"
-        user_settings = cache.get(settings_cache_name)
+        loader = current_user_settings_loader.get()
+        if loader is not None:
+            return loader.get(user)
+
+        local_cache = get_user_settings_local_cache()
+        user_settings = local_cache.get(user.pk)
+        if user_settings is not None:
+            return user_settings
 
-        if not user_settings:
-            user_settings = UserSettings.objects.get(user=user)
-            cache.set(settings_cache_name, user_settings, float(get_user_settings_cache_timeout()))
+        settings_cache_name = get_user_settings_cache_key(user.pk)
+        user_settings = load_user_settings_snapshot(cache.get(settings_cache_name))
+
+        if user_settings is None:
+            user_settings = make_user_settings_snapshot(
+                UserSettings.objects.only(*USER_SETTINGS_SNAPSHOT_FIELDS).get(user=user)
+            )
+            cache.set(settings_cache_name, dump_user_settings_snapshot(user_settings),
+                      float(get_user_settings_cache_timeout()))
+        local_cache.set(user.pk, user_settings)
         return user_settings
     raise TypeError(f"Object {user} is not User instance")
 
 
-def get_user_timezone(user: User) -> str:
+@dataclass
+class UserSettingsLoaderStats:
+    """
+    Счетчики загрузчика настроек. memo_hits - обращения, обслуженные запомненными настройками,
+    то есть сэкономленные обращения к кэшам и базе. Остальные - откуда были загружены настройки.
+    """
+
+    memo_hits: int = 0
+    local_cache_hits: int = 0
+    cache_hits: int = 0
+    db_loads: int = 0
+
+    def __iadd__(self, other: 'UserSettingsLoaderStats') -> 'UserSettingsLoaderStats':
+        for field in fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+        return self
+
+    def __str__(self):
+        return ", ".join(f"{field.name}={getattr(self, field.name)}" for field in fields(self))
+
+
+class UserSettingsLoader(object):
+    """
+    Пакетный загрузчик настроек пользователей. Настройки всех пользователей страницы берутся из кэша
+    процесса, остальные загружаются одним cache.get_many и одним запросом к базе для промахов кэша,
+    загруженные настройки запоминаются.
+    """
+
+    def __init__(self):
+        self.loaded: Dict[int, UserSettingsSnapshot] = dict()
+        self.stats = UserSettingsLoaderStats()
+
+    def load_many(self, users: Iterable[User | int]) -> Dict[int, UserSettingsSnapshot]:
+        ids = {user.pk if isinstance(user, User) else user for user in users}
+        missing = ids - self.loaded.keys()
+        self.stats.memo_hits += len(ids) - len(missing)
+        if missing:
+            local_cache = get_user_settings_local_cache()
+            local = cast(Dict[int, UserSettingsSnapshot], local_cache.get_many(missing))
+            self.stats.local_cache_hits += len(local)
+            self.loaded |= local
+            missing -= local.keys()
+        if missing:
+            keys = get_user_settings_cache_keys(missing)
+            values = cache.get_many(keys.values())
+            cached = {pk: snapshot for pk, key in keys.items()
+                      if (snapshot := load_user_settings_snapshot(values.get(key))) is not None}
+            fetched = {s.user_id: make_user_settings_snapshot(s) for s in UserSettings.objects.filter(
+                user_id__in=missing - cached.keys()).only(*USER_SETTINGS_SNAPSHOT_FIELDS)}
+            if fetched:
+                cache.set_many({keys[pk]: dump_user_settings_snapshot(s) for pk, s in fetched.items()},
+                               float(get_user_settings_cache_timeout()))
+            local_cache.set_many(cached | fetched)
+            self.stats.cache_hits += len(cached)
+            self.stats.db_loads += len(fetched)
+            self.loaded |= cached | fetched
+        return {pk: self.loaded[pk] for pk in ids if pk in self.loaded}
+
+    def get(self, user: User | int) -> UserSettingsSnapshot:
+        pk = user.pk if isinstance(user, User) else user
+        if pk in self.loaded:
+            self.stats.memo_hits += 1
+        else:
+            self.load_many((pk,))
+        try:
+            return self.loaded[pk]
+        except KeyError:
+            raise UserSettings.DoesNotExist(f"Settings of user {pk} does not exist") from None
+
+
+# Загрузчик настроек текущего запроса (schemora.settings.middleware.UserSettingsMemoMiddleware).
+# Через него get_user_settings запоминает настройки пользователей до конца запроса.
+current_user_settings_loader: ContextVar[Optional[UserSettingsLoader]] = ContextVar(
+    "current_user_settings_loader", default=None
+)
+
+
+def get_user_settings_loader(request: HttpRequest) -> UserSettingsLoader:
+    """ Функция для получения загрузчика настроек, общего для всех обработчиков одного запроса. """
+
+    request = getattr(request, "_request", request)
+    if not hasattr(request, "user_settings_loader"):
+        setattr(request, "user_settings_loader", current_user_settings_loader.get() or UserSettingsLoader())
+    return getattr(request, "user_settings_loader")
+
+
+def invalidate_user_settings(user_id: int) -> Literal[None]:
+    """ Сброс закэшированных настроек пользователя, в том числе запомненных в текущем запросе. """
+
+    loader = current_user_settings_loader.get()
+    if loader is not None:
+        loader.loaded.pop(user_id, None)
+    return invalidate_user_settings_cache(user_id)
+
+
+def get_request_user_settings(request: HttpRequest) -> UserSettingsSnapshot | AnonymousUser:
+    """ Функция для получения настроек текущего пользователя через загрузчик запроса. """
+
+    user = request.user
+    return get_user_settings_loader(request).get(user) if user.is_authenticated else user
+
+
+def get_user_timezone(user: User | AnonymousUser | UserSettings | UserSettingsSnapshot) -> str:
     """ Получение временной зоны пользователя. """
 
     if isinstance(user, AnonymousUser):
@@ -46,47 +190,83 @@ def get_user_timezone(user: User) -> str:
     return get_user_settings(user).timezone
 
 
-def get_user_avatar_path(user: User | UserSettings) -> Tuple:
+class ImageVariant(NamedTuple):
     """
-    Получение пути до обрезанного аватара пользователя по ссылке на него
-    или по ссылке на объект его настроек.
+    Вариант изображения одного размера: пути файлов WebP и JPEG относительно MEDIA_ROOT
+    и версия содержимого исходного файла для их URL (пустая, если неизвестна).
+    """
+
+    size: int
+    webp: Optional[str]
+    jpeg: str
+    version: str = ""
+
+
+def get_user_avatar_path(user: User | UserSettings | UserSettingsSnapshot, size: int) \
+        -> Tuple[ImageVariant, UserSettings | UserSettingsSnapshot]:
+    """
+    Получение варианта обрезанного аватара пользователя размера size по ссылке на него
+    или по ссылке на объект его настроек. Аватар по умолчанию отдается как есть, без WebP.
     """
 
     user_settings = get_user_settings(user)
     avatar_path = str(user_settings.avatar)
-    if avatar_path == str(schemora_settings.USER_SETTINGS.DEFAULT_USER_AVATAR_FILENAME):
-        return avatar_path, user_settings
-    else:
-        return get_upload_crop_path(avatar_path), user_settings
+    if not avatar_path or avatar_path == str(schemora_settings.USER_SETTINGS.DEFAULT_USER_AVATAR_FILENAME):
+        return ImageVariant(size, None, avatar_path), user_settings
+    return get_upload_variant(avatar_path, size, user_settings.avatar_version), user_settings
 
 
-def get_datetime_in_timezone(dt: datetime, timezone: str) -> datetime:
-    """ Получение datetime объекта в определенной временной зоне. """
+@lru_cache(maxsize=None)
+def get_timezone(timezone: Optional[str]) -> ZoneInfo:
+    """
+    Получение объекта временной зоны по названию. Пустое название, 'Default' (старые настройки)
+    и неизвестные зоны заменяются зоной по умолчанию.
+    """
 
-    dt = pytz.timezone(timezone).localize(datetime(dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second))
-    return dt + dt.utcoffset()
+    for name in (timezone, schemora_settings.USER_SETTINGS.DEFAULT_USER_TIMEZONE):
+        if not name or name == "Default":
+            continue
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            continue
+    return ZoneInfo("UTC")
 
 
-def get_instance_datetime_attribute(user: User, instance: Any, attribute: str = "time_added") -> Dict[str, str]:
-    """ Получение DateTime атрибута объекта в выбранной временной зоне пользователя. """
+def get_datetime_in_timezone(dt: datetime, timezone: str | tzinfo) -> datetime:
+    """ Получение datetime объекта в определенной временной зоне. Наивный datetime считается UTC. """
 
-    assert hasattr(instance, attribute), AttributeError(
-        f"Invalid {instance.__class__.__name__} model field: {attribute}"
-    )
-    dt = getattr(instance, attribute)
-    user_timezone = get_user_timezone(user)
-    dt = get_datetime_in_timezone(dt, user_timezone)
-    return {
-        attribute: dt.strftime("%H:%M %d/%m/%Y"),
-        "time_zone": user_timezone,
-    }
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=dt_timezone.utc)
+    return dt.astimezone(timezone if isinstance(timezone, tzinfo) else get_timezone(timezone))
 
 
-def get_upload_crop_path(path: str) -> str:
-    """ Функция для получения пути к центрированному изображению по пути исходного. """
+def get_upload_crop_path(path: str, size: Optional[int] = None, extension: Optional[str] = None) -> str:
+    """
+    Функция для получения пути к центрированному изображению по пути исходного.
+    С размером - путь варианта этого размера в формате extension (services.image_variants).
+    Расширение исходного файла входит в имя варианта: у 5.png и 5.jpg разные варианты.
+    """
 
     splitted_path = path.split("/")
     filename = splitted_path.pop()
-    name, extension = filename.split(".")
-    splitted_path.append(f"{name}_crop.{extension}")
+    name, original_extension = filename.rsplit(".", 1)
+    if size is None:
+        splitted_path.append(f"{name}_crop.{extension or original_extension}")
+    else:
+        splitted_path.append(f"{name}_{original_extension}_crop_{size}.{extension or original_extension}")
     return "/".join(splitted_path)
+
+
+def get_upload_variant(path: str, size: int, version: str = "") -> ImageVariant:
+    return ImageVariant(size, get_upload_crop_path(path, size, "webp"), get_upload_crop_path(path, size, "jpg"),
+                        version)
+
+
+def get_versioned_path(path: str, version: Optional[str]) -> str:
+    """
+    Путь или URL файла с версией его содержимого (?v=<версия>). Версия меняется вместе с содержимым,
+    поэтому такие URL кэшируются браузером без перепроверки (nginx.conf, location /media/).
+    """
+
+    return f"{path}?v={version}" if version else path
@@ -0,0 +1,54 @@
+import logging
+from threading import Lock
+from typing import Callable, Literal
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from schemora.settings.helpers import UserSettingsLoader, UserSettingsLoaderStats, current_user_settings_loader
+
+logger = logging.getLogger("schemora.settings")
+
+# Счетчики загрузчиков настроек всех запросов процесса.
+_totals, _totals_lock = UserSettingsLoaderStats(), Lock()
+
+
+def get_user_settings_memo_totals() -> UserSettingsLoaderStats:
+    with _totals_lock:
+        return UserSettingsLoaderStats(**vars(_totals))
+
+
+def reset_user_settings_memo_totals() -> Literal[None]:
+    global _totals
+    with _totals_lock:
+        _totals = UserSettingsLoaderStats()
+    return None
+
+
+class UserSettingsMemoMiddleware(object):
+    """
+    Middleware, создающий на время запроса общий загрузчик настроек пользователей (contextvar):
+    настройки текущего пользователя и авторов, загруженные одним обработчиком, не запрашиваются
+    из кэша повторно другими. Счетчики загрузчика пишутся в лог schemora.settings (DEBUG)
+    и суммируются по процессу, при DEBUG они возвращаются в заголовке X-User-Settings-Memo.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        global _totals
+        loader = UserSettingsLoader()
+        setattr(request, "user_settings_loader", loader)
+        token = current_user_settings_loader.set(loader)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_user_settings_loader.reset(token)
+
+        with _totals_lock:
+            _totals += loader.stats
+        logger.debug("User settings loader of %s: %s", request.path, loader.stats)
+        if settings.DEBUG:
+            response["X-User-Settings-Memo"] = str(loader.stats)
+        return response
@@ -0,0 +1,34 @@
+from typing import NamedTuple, Optional, Tuple
+
+# Версия формата настроек в кэше. Увеличивается при изменении полей UserSettingsSnapshot:
+# записи прежнего формата после деплоя считаются промахами кэша, а не ломают чтение.
+USER_SETTINGS_SNAPSHOT_VERSION = 3
+
+
+class UserSettingsSnapshot(NamedTuple):
+    """
+    Настройки пользователя только для чтения: поля, которые читаются при отображении страниц и API.
+    Путь аватара указан относительно MEDIA_ROOT, пути его вариантов получаются из него.
+    avatar_version - версия содержимого аватара для его URL (пустая у аватара по умолчанию).
+    """
+
+    user_id: int
+    timezone: str
+    avatar: str
+    avatar_version: str
+    signature: str
+
+
+def dump_user_settings_snapshot(snapshot: UserSettingsSnapshot) -> Tuple:
+    """ Компактное представление настроек для кэша: версия формата и значения полей. """
+
+    return USER_SETTINGS_SNAPSHOT_VERSION, *snapshot
+
+
+def load_user_settings_snapshot(payload: object) -> Optional[UserSettingsSnapshot]:
+    """ Функция для чтения настроек из кэша. Запись другой версии или формата считается отсутствующей. """
+
+    if not isinstance(payload, tuple) or len(payload) != len(UserSettingsSnapshot._fields) + 1:
+        return None
+    version, *values = payload
+    return UserSettingsSnapshot(*values) if version == USER_SETTINGS_SNAPSHOT_VERSION else None
@@ -2,21 +2,27 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime
-from random import randrange
-from typing import Dict, List, Literal, Optional
+from functools import partial
+from typing import Dict, List, Literal, NamedTuple, Optional, Sequence
 
 from django.conf import settings
-from django.core.cache import cache
-from django.db.models import Count, Q, QuerySet
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 
 from forum_app.constants import dict_sections
 from forum_app.forms import AddCommentForm, AddTopicForm
-from forum_app.models import Topic
+from forum_app.models import Comment, SectionStats, Topic
 from schemora.core.enums import RequestHost
-from schemora.settings.helpers import get_upload_crop_path, get_user_avatar_path, get_user_settings_model
+from schemora.settings.helpers import (
+    UserSettingsLoader,
+    get_upload_variant,
+    get_user_avatar_path,
+    get_user_settings_loader,
+    get_user_settings_model,
+    get_versioned_path,
+)
 from services.common_utils import Context
 from services.forum_mixins import (
     AddInstanceMixin,
@@ -29,6 +35,8 @@ from services.forum_mixins import (
     get_topic_and_validate_section,
     validate_section,
 )
+from services.image_variants import AVATAR_VARIANT_SIZE, UPLOAD_VARIANT_SIZE
+from services.topic_fragments import get_topic_fragments_version
 
 Username = str
 UserSettings = get_user_settings_model()
@@ -41,10 +49,18 @@ class ExtendedSection:
     section: str
     section_url_alias: str
     all_topics_count: Optional[int] = None
+    all_comments_count: Optional[int] = None
     last_updated_time: Optional[datetime] = None
     last_updated_user: Optional[Username] = None
 
 
+class TopicPage(NamedTuple):
+    """ Обработанные для рендеринга заголовок темы и страница ее комментариев. """
+
+    topic: TopicOrCommentObject
+    comments: Dict[str, TopicOrCommentObject]
+
+
 class ForumHomeViewUtils(BaseContextMixin):
     def forum_home_view_utils(self, request: HttpRequest) -> Context:
         context = self.get_base_context(request, get_tzone=True, forum_menu=True, view_info_menu=True)
@@ -52,25 +68,14 @@ class ForumHomeViewUtils(BaseContextMixin):
         return context
 
     def _get_extended_sections(self) -> List[ExtendedSection]:
-        sections = []
-        url_aliases = dict_sections.keys()
-
-        aggregate_count = cache.get(settings.AGGREGATE_COUNT_CACHE_NAME)
-        if not aggregate_count:
-            aggregate_count_query = dict()
-            for url_alias in url_aliases:
-                aggregate_count_query[f"{url_alias}__count"] = Count("section", filter=Q(section=f"{url_alias}"))
-            aggregate_count = Topic.objects.aggregate(**aggregate_count_query)
-            cache.set(settings.AGGREGATE_COUNT_CACHE_NAME, aggregate_count, 60*60)
-
+        sections, stats = [], SectionStats.objects.get_sections()
         for url_alias, name in dict_sections.items():
-            section = ExtendedSection(name, url_alias)
-            section.all_topics_count = aggregate_count[f"{url_alias}__count"]
-            last_topic = (Topic.objects.select_related("author").only("time_added", "author__username")
-                          .filter(section=section.section_url_alias).first())
-            if last_topic:
-                section.last_updated_time, section.last_updated_user = last_topic.time_added, last_topic.author.username
-            sections.append(section)
+            section_stats = stats[url_alias]
+            last_user = section_stats.last_activity_user
+            sections.append(ExtendedSection(
+                name, url_alias, section_stats.topics_count, section_stats.comments_count,
+                section_stats.last_activity_at, last_user.username if last_user else None
+            ))
         return sections
 
 
@@ -100,29 +105,43 @@ class SomeIdUtils(BaseContextMixin):
 
     def some_id_view_utils(self, request: HttpRequest, section: str, ids: int) -> Context:
         tpc, section = get_topic_and_validate_section(ids, section)
-        topic = TopicOrCommentObject(tpc)
-        topic.path_to_author_avatar, user_settings = get_user_avatar_path(topic.obj.author)
-        topic = self._set_avatar_and_upload_attributes(topic, user_settings)
-        topic.user_signature = user_settings.signature
         action = OffsetAction("forum_app:some_id", section, str(ids))
         context = self.get_base_context(
-            request, delete=request.user == topic.obj.author, queryset=topic.obj.comments, offset_action=action,
-            section=section, **self.static_context_variables
+            request, delete=request.user == tpc.author, queryset=tpc.comments, offset_action=action,
+            section=section, queryset_count=tpc.comments_count, **self.static_context_variables
         )
-        context["comments"] = self._comments_to_dict(context["offset_params"]["offset"], context["comments"])
-        self._process_comments(context["comments"])
-        context["topic"], context["any_random_integer"] = topic, randrange(100000)
+        # Заголовок темы и страница комментариев кэшируются шаблоном по версии фрагментов темы:
+        # при попадании в кэш комментарии и настройки их авторов не загружаются.
+        context["page"] = SimpleLazyObject(partial(self._get_topic_page, request, tpc,
+                                                   context["offset_params"]["offset"], context["comments"]))
+        context["topic"] = TopicOrCommentObject(tpc)
+        context["fragments_version"] = get_topic_fragments_version(tpc.pk)
+        context["fragments_timeout"] = settings.TOPIC_FRAGMENTS_CACHE_TIMEOUT
         return context
 
-    def _process_comments(self, comments: Dict[str, TopicOrCommentObject]) -> Literal[None]:
+    def _get_topic_page(self, request: HttpRequest, tpc: Topic, offset: int, comments: Sequence[Comment]) \
+            -> TopicPage:
+        page_comments = self._comments_to_dict(offset, comments)
+        # Настройки автора темы и всех комментаторов страницы загружаются одним пакетом.
+        loader = get_user_settings_loader(request)
+        loader.load_many((tpc.author_id, *(comment.obj.author_id for comment in page_comments.values())))
+        user_settings = loader.get(tpc.author_id)
+        topic = self._set_avatar_and_upload_attributes(TopicOrCommentObject(tpc), user_settings, avatar=True)
+        topic.user_signature = user_settings.signature
+        self._process_comments(page_comments, loader)
+        return TopicPage(topic, page_comments)
+
+    def _process_comments(self, comments: Dict[str, TopicOrCommentObject], loader: UserSettingsLoader) \
+            -> Literal[None]:
         """
         Функция для финальной обработки комментариев (установки подписей авторов,
         путей и ссылок на их аватарки и вложения к комментарию).
         """
 
-        authors_settings = self._set_user_signatures(comments)
-        for author_settings, comment in zip(authors_settings, comments.items()):
-            self._set_avatar_and_upload_attributes(comment[1], author_settings, avatar=True)
+        for comment in comments.values():
+            author_settings = loader.get(comment.obj.author_id)
+            comment.user_signature = author_settings.signature
+            self._set_avatar_and_upload_attributes(comment, author_settings, avatar=True)
 
     def _set_avatar_and_upload_attributes(self, obj: TopicOrCommentObject, user_settings: UserSettings,
                                           avatar: Optional[bool] = False) -> TopicOrCommentObject:
@@ -132,34 +151,16 @@ class SomeIdUtils(BaseContextMixin):
         """
 
         if avatar:
-            obj.path_to_author_avatar, _ = get_user_avatar_path(user_settings)
+            obj.path_to_author_avatar, _ = get_user_avatar_path(user_settings, AVATAR_VARIANT_SIZE)
         if obj.obj.upload != "":
-            obj.url_to_upload = obj.obj.upload.path.split(settings.MEDIA_ROOT)[-1]
-            obj.path_to_crop_upload = get_upload_crop_path(str(obj.obj.upload))
+            version = obj.obj.upload_version
+            obj.url_to_upload = get_versioned_path(obj.obj.upload.path.split(settings.MEDIA_ROOT)[-1], version)
+            obj.path_to_crop_upload = get_upload_variant(str(obj.obj.upload), UPLOAD_VARIANT_SIZE, version)
             obj.percents_of_tds_widths = PercentsOfTableData("20%", "65%", "15%")
         return obj
 
-    def _set_user_signatures(self, comments: Dict[str, TopicOrCommentObject]) -> List[UserSettings]:
-        """ Функция для установления подписей комментаторов. """
-
-        authors = tuple(comment.obj.author for comment in comments.values())
-        user_settings, authors_settings = UserSettings.objects.filter(user__in=authors).all(), list()
-        for author in authors:
-            for author_settings in user_settings:
-                if author == author_settings.user:
-                    authors_settings.append(author_settings)
-        for author_settings, comment in zip(authors_settings, comments.items()):
-            comment[1].user_signature = author_settings.signature
-        return authors_settings
-
-    def _comments_to_dict(self, offset: int, comments_: QuerySet) -> Dict[str, TopicOrCommentObject]:
-        comments = {}
-        for position in range(offset + 1, offset + 21):
-            try:
-                comments[str(position)] = TopicOrCommentObject(comments_[position - 1])
-            except IndexError:
-                break
-        return comments
+    def _comments_to_dict(self, offset: int, comments: Sequence[Comment]) -> Dict[str, TopicOrCommentObject]:
+        return {str(position): TopicOrCommentObject(comment) for position, comment in enumerate(comments, offset + 1)}
 
 
 class AddTopicViewUtils(AddInstanceMixin):
@@ -190,7 +191,8 @@ class AddCommentViewUtils(AddInstanceMixin):
     def add_comment_view_post_utils(self, view_self, request: HttpRequest, section: str, ids: int) -> HttpResponse:
         topic, comment = self.add_instance(request.user, request.POST, request.FILES, topic=ids, section=section)
         if isinstance(topic, Topic) and comment:
-            count = topic.comments.count()
+            # Счетчик темы уже увеличен при добавлении комментария (TopicManager.add_comment).
+            count = topic.comments_count
             if not count >= 20:
                 return redirect(reverse("forum_app:some_id", kwargs={"ids": ids, "section": section}))
             return redirect(f'{reverse("forum_app:some_id", kwargs={"ids": ids, "section": section})}'
@@ -1,28 +1,35 @@
 from dataclasses import dataclass
-from typing import Dict, Iterable, List, Literal, NamedTuple, NoReturn, Optional, Sized, Tuple
+from typing import Dict, List, Literal, NamedTuple, NoReturn, Optional, Sequence, Sized, Tuple, cast
 
-from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
-from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from django.db.models import F, Q
+from django.db import transaction
 from django.db.models.query import QuerySet
 from django.http import Http404, HttpRequest
 from django.shortcuts import get_object_or_404
 
-from error_messages.forum_error_messages import COMMENTS_ERRORS, TOPICS_ERRORS, ErrorMessage
-from forum_app.constants import SearchParamsExpressions, dict_sections
-from forum_app.models import Comment, Topic
+from error_messages.forum_error_messages import COMMENTS_ERRORS, TOPICS_ERRORS, ErrorMessage, ModelField
+from forum_app.constants import SearchParamsExpressions, TopicSortExpressions, dict_sections
+from forum_app.models import Comment, Topic, rename_temporary_upload
 from schemora.core.enums import RequestHost
 from schemora.core.mixins import DataValidationMixin
-from schemora.settings.helpers import get_user_settings_model, get_user_timezone
+from schemora.settings.helpers import (
+    ImageVariant,
+    get_request_user_settings,
+    get_user_settings_model,
+    get_user_timezone,
+)
 from services.common_utils import Context
-from tasks.home_app_tasks import make_center_crop
+from services.forum_stats import get_forum_stats
+from services.page_cache import bump_instance_pages_versions
+from services.pagination import DEFAULT_KEYSET_ORDERING, Cursor, Ordering, paginate_keyset
+from services.search_backends import get_search_backend
+from services.views_buffer import get_views_buffer
+from tasks.home_app_tasks import make_image_variants
 
 ReverseURL = str
 UserSettings = get_user_settings_model()
 
-
 class PercentsOfTableData(NamedTuple):
     """
     Кортеж для хранения информации о ширине 'td' HTML тэгов.
@@ -39,9 +46,9 @@ class TopicOrCommentObject:
     """ Датакласс для хранения всей нужной для рендеринга информации о заголовке темы или комментарие. """
 
     obj: Topic | Comment
-    path_to_author_avatar: Optional[str] = None
+    path_to_author_avatar: Optional[ImageVariant] = None
     url_to_upload: Optional[str] = None
-    path_to_crop_upload: Optional[str] = None
+    path_to_crop_upload: Optional[ImageVariant] = None
     percents_of_tds_widths: PercentsOfTableData = PercentsOfTableData()
     section: Optional[str] = None
     user_signature: Optional[str] = None
@@ -60,11 +67,21 @@ class OffsetButton(NamedTuple):
         return self.offset - other
 
 
+class CursorButton(NamedTuple):
+    """ Класс для хранения нужной HTML кнопке переключения страницы при keyset-пагинации. """
+
+    cursor: Optional[Cursor]
+    view_button: bool
+
+    def __str__(self):
+        return self.cursor or ""
+
+
 class ObjectsAndOffsets(NamedTuple):
-    objects: QuerySet
-    offset: int
-    offset_next: OffsetButton
-    offset_back: OffsetButton
+    objects: QuerySet | List
+    offset: int | Optional[Cursor]
+    offset_next: OffsetButton | CursorButton
+    offset_back: OffsetButton | CursorButton
 
 
 class AddInstanceReturn(NamedTuple):
@@ -93,8 +110,8 @@ def get_topic_and_validate_section(ids: int, section: Optional[str] = None) -> T
     """ Функция для получения темы по ее ids и проверки ее секции на соответствие секции, переданной пользователем. """
 
     topic_fields = (
-        "id", "title", "question", "time_added", "upload", "author__username",
-        "author__date_joined", "section", "views"
+        "id", "title", "question", "time_added", "upload", "upload_version", "author__username",
+        "author__date_joined", "section", "views", "comments_count"
     )
     topic_q = Topic.objects.select_related("author").only(*topic_fields).filter(pk=ids)
     topic = topic_q.first()
@@ -102,41 +119,24 @@ def get_topic_and_validate_section(ids: int, section: Optional[str] = None) -> T
         raise Http404
     if section:
         section = validate_section(section, topic)
-    topic_q.update(views=F("views")+1)
+    # Просмотр копится в буфере и переносится в базу периодической таской (flush_topic_views).
+    topic.views += get_views_buffer().increment(topic.pk)
     return topic, section
 
 
-def get_and_validate_offset(request: HttpRequest, instance: Sized) -> int:
-    """ Функция для проверки переданного оффсета. """
+def get_and_validate_offset(request: HttpRequest, instance: Sized | int) -> int:
+    """ Функция для проверки переданного оффсета. Вместо коллекции можно передать ее размер. """
 
+    size = instance if isinstance(instance, int) else len(instance)
     try:
         offset = int(request.GET.get("offset", 0))
-        if offset % 20 != 0 or offset >= len(instance) or offset < 0:
+        if offset % 20 != 0 or offset >= size or offset < 0:
             offset = 0
     except ValueError:
         offset = 0
     return offset
 
 
-def get_general_forum_information() -> List:
-    info = []
-
-    for cache_name, getter in {
-        settings.LAST_JOINED_CACHE_NAME: User.objects.order_by("-date_joined").first,
-        settings.TOTAL_TOPICS_CACHE_NAME: Topic.objects.count,
-        settings.TOTAL_COMMENTS_CACHE_NAME: Comment.objects.count
-    }.items():
-        value = cache.get(cache_name)
-        if value:
-            info.append(value)
-        else:
-            res = getter()
-            cache.set(cache_name, res, 60*60)
-            info.append(res)
-
-    return info
-
-
 class BaseContextMixin(object):
     """ Класс для удобного формирования базового контекста. """
 
@@ -148,23 +148,32 @@ class BaseContextMixin(object):
         "view_add_comment_button": "add_comment_button",
         "search_keys": "search_keys"
     }
+    # Использовать keyset-пагинацию по (time_added, id) вместо оффсета.
+    keyset_pagination: bool = False
+    page_size: int = 20
 
     def get_base_context(self, request: HttpRequest, **kwargs) -> Context:
-        context: Context = Context({"offset_params": {}})
+        context: Context = Context({"offset_params": {"param": "cursor" if self.keyset_pagination else "offset"}})
         queryset = kwargs.get("queryset", False)
         for template_name, arg_name in self.static_base_context_variables.items():
             context[template_name] = kwargs.get(arg_name)
         if kwargs.get("get_tzone", False):
-            context["tzone"] = get_user_timezone(request.user)
+            context["tzone"] = get_user_timezone(get_request_user_settings(request))
         if kwargs.get("view_info_menu", False):
-            info = get_general_forum_information()
-            context["view_info_menu"], context["last_joined"] = True, info[0]
+            stats = get_forum_stats()
+            context["view_info_menu"], context["last_joined"] = True, stats.last_joined
             context["tzone"] = "UTC" if context["tzone"] in ("Default", False) else context["tzone"]
-            context["total_topics"] = info[1]
-            context["total_messages"] = info[1] + info[2]
+            context["total_topics"] = stats.topics_count
+            context["total_messages"] = stats.messages_count
         if queryset is not False:
-            objects, offset, offset_next, offset_back = self._clip_topics_and_get_offset_params(request, queryset)
-            context[kwargs["queryset_context_alias"]] = objects if len(objects) > 0 else tuple()
+            objects, offset, offset_next, offset_back = (
+                self._clip_topics_and_get_cursor_params(request, queryset, kwargs.get("ordering")) if
+                self.keyset_pagination else
+                self._clip_topics_and_get_offset_params(request, queryset, kwargs.get("queryset_count"))
+            )
+            # Срез queryset'а с известным размером остается ленивым до рендера (пустой queryset и так ложен в шаблоне).
+            lazy = kwargs.get("queryset_count") is not None
+            context[kwargs["queryset_context_alias"]] = objects if lazy or len(objects) > 0 else tuple()
             context["offset_params"]["offset_next"], context["offset_params"]["offset"] = offset_next, offset
             context["offset_params"]["offset_back"] = offset_back
             context["offset_params"]["search"] = request.GET.get("search", False)
@@ -172,7 +181,17 @@ class BaseContextMixin(object):
             context["offset_action"] = action
         return context
 
-    def _clip_topics_and_get_offset_params(self, request: HttpRequest, queryset: QuerySet) -> ObjectsAndOffsets:
+    def _clip_topics_and_get_offset_params(self, request: HttpRequest, queryset: QuerySet,
+                                           count: Optional[int] = None) -> ObjectsAndOffsets:
+        if count is not None:
+            # Размер выборки известен заранее: загружается только срез страницы, без len() всего queryset'а.
+            offset = get_and_validate_offset(request, count)
+            return ObjectsAndOffsets(
+                queryset[offset:offset + 20],
+                offset,
+                OffsetButton(offset + 20, offset + 20 < count),
+                OffsetButton(offset - 20, offset > 0),
+            )
         offset = get_and_validate_offset(request, queryset)
         return ObjectsAndOffsets(
             queryset,
@@ -181,6 +200,17 @@ class BaseContextMixin(object):
             OffsetButton(offset - 20, len(queryset[:offset]) > 0),
         )
 
+    def _clip_topics_and_get_cursor_params(self, request: HttpRequest, queryset: QuerySet,
+                                           ordering: Optional[Ordering] = None) -> ObjectsAndOffsets:
+        cursor = request.GET.get("cursor", None)
+        page = paginate_keyset(queryset, cursor, self.page_size, ordering or DEFAULT_KEYSET_ORDERING)
+        return ObjectsAndOffsets(
+            page.objects,
+            cursor,
+            CursorButton(page.next_cursor, page.next_cursor is not None),
+            CursorButton(page.previous_cursor, page.previous_cursor is not None),
+        )
+
 
 class SearchContextMixin(BaseContextMixin):
     """ Класс для удобного формирования базового контекста для страниц, поддерживающих поиск. """
@@ -192,42 +222,49 @@ class SearchContextMixin(BaseContextMixin):
         "queryset_context_alias": "all_topics",
         "view_info_menu": True
     }
+    keyset_pagination = True
 
-    def _get_search_query(self, request: HttpRequest) -> Tuple[Q, Iterable]:
-        search = request.GET.get("search", False)
+    def _get_search_params(self, request: HttpRequest) -> Tuple[str | Literal[False], Sequence[ModelField]]:
+        search = request.GET.get("search", "")
         if not search:
-            return Q(), tuple()
-        filter_kwargs = {f: search for p, f in SearchParamsExpressions.Params.items() if request.GET.get(p, False)}
-        query = Q()
-        for f, q in filter_kwargs.items():
-            query = query | Q(**{f"{f}__icontains": q})
-        return query, filter_kwargs.keys()
+            return False, tuple()
+        return search, tuple(f for p, f in SearchParamsExpressions.Params.items() if request.GET.get(p, False))
 
     def get_search_context(self, request: HttpRequest, offset_action: OffsetAction, convert_objects: bool = False,
                            **base_topic_filters) -> Context:
         if base_topic_filters.get("section", False):
             base_topic_filters["section"] = validate_section(base_topic_filters["section"])
-        query, filter_keys = self._get_search_query(request)
-        fields = "title", "section", "views", "time_added", "author__username"
-        queryset = Topic.objects.select_related("author").only(*fields).filter(**base_topic_filters).filter(query)
+        search, filter_keys = self._get_search_params(request)
+        sort, ordering = self._get_and_validate_sort(request)
+        fields = "title", "section", "views", "time_added", "comments_count", "last_activity_at", "author__username"
+        queryset = Topic.objects.select_related("author").only(*fields).filter(**base_topic_filters)
+        if search and filter_keys:
+            backend = get_search_backend()
+            queryset, ordering = backend.filter_queryset(queryset, (search,), filter_keys), ordering or backend.ordering
         context = self.get_base_context(
             request, queryset=queryset, section=dict_sections.get(base_topic_filters.get("section", None)),
-            search_keys=filter_keys, offset_action=offset_action, **self.static_search_context_variables
+            search_keys=filter_keys, offset_action=offset_action, ordering=ordering,
+            **self.static_search_context_variables
         )
-        offset, offset_next = context["offset_params"]["offset"], context["offset_params"]["offset_next"].offset
-        context["all_topics"] = context["all_topics"][offset:offset_next]
+        context["offset_params"]["sort"] = sort
+        # Параметры поиска переносятся в формы перехода по страницам: иначе курсор не совпадет с выборкой.
+        context["offset_params"]["search_params"] = tuple(p for p in SearchParamsExpressions.Params
+                                                          if search and request.GET.get(p, False))
+        get_views_buffer().add_pending_views(context["all_topics"])
+        if not self.keyset_pagination:
+            offset, offset_next = context["offset_params"]["offset"], context["offset_params"]["offset_next"].offset
+            context["all_topics"] = context["all_topics"][offset:offset_next]
         context["all_topics_count"] = len(context["all_topics"])
         if context["all_topics_count"] > 0 and convert_objects:
             context["all_topics"] = tuple(TopicOrCommentObject(topic, section=dict_sections[topic.section])
                                           for topic in context["all_topics"])
         return context
 
-    # Как тут сделать сортировку?..
-    # def _get_and_validate_sort(self, request: HttpRequest) -> Literal[False] | str:
-    #     sort = request.GET.get("sort", False)
-    #     if sort and sort == "time_updated":
-    #         return "time_updated"
-    #     return False
+    def _get_and_validate_sort(self, request: HttpRequest) -> Tuple[str | Literal[False], Optional[Ordering]]:
+        sort = request.GET.get("sort", "")
+        if sort and sort in TopicSortExpressions.Params:
+            return sort, TopicSortExpressions.Params[sort]
+        return False, None
 
 
 class DeleteTopicMixin(object):
@@ -235,16 +272,10 @@ class DeleteTopicMixin(object):
 
     def delete_topic(self, request: HttpRequest, ids: int, section: Optional[str] = None) -> Literal[None] | NoReturn:
         topic = self.check_perms(request, ids, section)
-        for comment in topic.comments:
-            comment.delete()
-        topic.delete()
-        cache.delete(settings.TOTAL_TOPICS_CACHE_NAME)
-        cache.delete(settings.TOTAL_COMMENTS_CACHE_NAME)
-        cache.delete(settings.AGGREGATE_COUNT_CACHE_NAME)
+        Topic.objects.delete_with_comments(topic)
         return None
 
-    def check_perms(self, request: HttpRequest, ids: int, section: Optional[str] = None) \
-            -> Topic | NoReturn | Literal[False]:
+    def check_perms(self, request: HttpRequest, ids: int, section: Optional[str] = None) -> Topic | NoReturn:
         topic = get_object_or_404(Topic, pk=ids)
         if section:
             validate_section(section, topic)
@@ -264,17 +295,28 @@ class AddInstanceMixin(DataValidationMixin):
         kwargs = self._get_and_validate_kwargs(user, topic, section)
         if isinstance(kwargs, ErrorMessage):
             return AddInstanceReturn(None, kwargs)
-        instance = Topic.objects.create(**kwargs) if not topic else Comment.objects.create(**kwargs)
+        # Данные проверяются на несохраненном объекте, поэтому отклоненные не пишутся в базу.
+        instance = Topic(**kwargs) if not topic else Comment(**kwargs)
         v, is_valid, data = self.validate_received_data(post, files, instance)
-
-        if is_valid:
-            instance = v.save()
-            if instance.upload:
-                make_center_crop.delay(instance.upload.path)
-            cache.delete(settings.TOTAL_TOPICS_CACHE_NAME if not topic else settings.TOTAL_COMMENTS_CACHE_NAME)
-            cache.delete(settings.AGGREGATE_COUNT_CACHE_NAME if not topic else None)
-            return AddInstanceReturn(*((instance, None) if not topic else (kwargs["topic"], instance)))
-        return self._get_error_return(instance, v, topic)
+        if not is_valid:
+            return self._get_error_return(v, topic)
+        # Запись (один INSERT) и статистика раздела (SectionStats) изменяются в одной транзакции.
+        # Вложение сохраняется под временным именем и получает имя по первичному ключу после фиксации.
+        with transaction.atomic():
+            instance = cast("Topic | Comment", v.save())
+            transaction.on_commit(lambda: self._process_upload(instance))
+        if isinstance(instance, Comment):
+            return AddInstanceReturn(kwargs["topic"], instance)
+        return AddInstanceReturn(instance, None)
+
+    @staticmethod
+    def _process_upload(instance: Topic | Comment) -> Literal[None]:
+        if instance.upload:
+            # Страница, отрисованная между фиксацией и переименованием, закэширована с временным именем.
+            if rename_temporary_upload(instance):
+                bump_instance_pages_versions(instance)
+            make_image_variants.delay(instance.upload.path)
+        return None
 
     def get_data_to_serializer(self, data: Dict, files: Dict) -> Dict:
         return data
@@ -294,8 +336,7 @@ class AddInstanceMixin(DataValidationMixin):
                 return TOPICS_ERRORS["section"]
         return kwargs
 
-    def _get_error_return(self, instance: Topic | Comment, v, topic: Optional[int] = None) -> AddInstanceReturn:
-        instance.delete()
+    def _get_error_return(self, v, topic: Optional[int] = None) -> AddInstanceReturn:
         is_view = self.request_host == RequestHost.VIEW
         error_field = list(v.errors.as_data().keys())[0] if is_view else v.errors.popitem(last=False)[0]
         return AddInstanceReturn(None, (TOPICS_ERRORS[error_field] if not topic else COMMENTS_ERRORS[error_field]))
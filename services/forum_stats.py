@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from math import log
+from random import random
+from time import monotonic, time
+from typing import Literal, NamedTuple, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from forum_app.models import SectionStats
+from schemora.cache import CacheNamespace
+
+# Поколение сводки: сменяется, когда сводка должна обновиться раньше срока (регистрация пользователя).
+forum_stats_cache = CacheNamespace(settings.FORUM_STATS_CACHE_NAME)
+
+
+class ForumStats(NamedTuple):
+    """ Сводка информационной панели форума. """
+
+    last_joined: Optional[User]
+    topics_count: int
+    comments_count: int
+
+    @property
+    def messages_count(self) -> int:
+        return self.topics_count + self.comments_count
+
+
+class ForumStatsSnapshot(NamedTuple):
+    """
+    Сводка в кэше. delta - время ее вычисления в секундах, expires_at - логический срок годности:
+    сама запись живет дольше, чтобы во время обновления отдавалась устаревшая сводка.
+    """
+
+    stats: ForumStats
+    generation: int
+    delta: float
+    expires_at: float
+
+
+def get_forum_stats_key() -> str:
+    return forum_stats_cache.delimiter.join((forum_stats_cache.name, "snapshot"))
+
+
+def get_forum_stats_lock_key() -> str:
+    return forum_stats_cache.delimiter.join((forum_stats_cache.name, "lock"))
+
+
+def compute_forum_stats() -> ForumStats:
+    totals = SectionStats.objects.get_totals()
+    return ForumStats(User.objects.order_by("-date_joined").first(), totals["topics"], totals["comments"])
+
+
+def is_snapshot_expired(snapshot: ForumStatsSnapshot, generation: Optional[int]) -> bool:
+    """
+    Вероятностное раннее истечение (XFetch): чем ближе срок годности и чем дольше вычисляется сводка,
+    тем вероятнее, что очередной запрос обновит ее заранее. Сводка другого поколения истекла сразу.
+    """
+
+    if snapshot.generation != generation:
+        return True
+    beta = settings.FORUM_STATS_XFETCH_BETA
+    return time() - snapshot.delta * beta * log(1 - random()) >= snapshot.expires_at
+
+
+def refresh_forum_stats(generation: int) -> ForumStats:
+    started = monotonic()
+    stats = compute_forum_stats()
+    delta = monotonic() - started
+    timeout = settings.FORUM_STATS_CACHE_TIMEOUT
+    snapshot = ForumStatsSnapshot(stats, generation, delta, time() + timeout)
+    cache.set(get_forum_stats_key(), snapshot, timeout=timeout * settings.FORUM_STATS_STALE_FACTOR)
+    return stats
+
+
+def get_forum_stats() -> ForumStats:
+    """
+    Функция для получения сводки форума: сводка и ее поколение читаются одним cache.get_many.
+    Истекшую сводку обновляет только получивший блокировку (cache.add) воркер,
+    остальные до конца обновления отдают устаревшую.
+    """
+
+    snapshot_key, generation_key = get_forum_stats_key(), forum_stats_cache.get_generation_key()
+    values = cache.get_many((snapshot_key, generation_key))
+    snapshot: Optional[ForumStatsSnapshot] = values.get(snapshot_key)
+    generation = values.get(generation_key)
+    if snapshot is not None and not is_snapshot_expired(snapshot, generation):
+        return snapshot.stats
+
+    lock_key = get_forum_stats_lock_key()
+    if not cache.add(lock_key, 1, timeout=settings.FORUM_STATS_LOCK_TIMEOUT):
+        # Сводку уже обновляет другой воркер. Без устаревшей сводки она вычисляется без записи в кэш.
+        return snapshot.stats if snapshot is not None else compute_forum_stats()
+    try:
+        if generation is None:
+            generation = forum_stats_cache.get_generation()
+        return refresh_forum_stats(generation)
+    finally:
+        cache.delete(lock_key)
+
+
+def invalidate_forum_stats() -> Literal[None]:
+    """ Сводка обновится при следующем запросе, до обновления отдается прежняя. """
+
+    return forum_stats_cache.invalidate()
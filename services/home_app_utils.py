@@ -1,27 +1,26 @@
 from __future__ import annotations
 
-from random import randrange
 from typing import Dict, Literal, NoReturn, Optional, Type
 
 import pytz
 from django import forms
-from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.models import User
-from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.http import Http404, HttpRequest, HttpResponse
 from django.shortcuts import redirect, reverse
 from rest_framework.request import Request
 
 from home_app.forms import AuthForm, ChangeSignatureForm, RegisterForm, UploadAvatarForm
-from home_app.models import UserRating
+from home_app.models import Review, UserRating
 from schemora.core.enums import RequestHost
 from schemora.core.types import E
 from schemora.settings.helpers import get_user_avatar_path, get_user_settings, get_user_settings_model
 from services.common_utils import Context
 from services.forum_mixins import BaseContextMixin
+from services.forum_stats import invalidate_forum_stats
 from services.home_mixins import AddReviewMixin, GetUserReviewsInformationMixin, UpdateSettingsMixin
+from services.image_variants import PROFILE_AVATAR_VARIANT_SIZE
 
 UserSettings = get_user_settings_model()
 
@@ -51,12 +50,11 @@ class SomeUserViewUtils(AddReviewMixin, BaseContextMixin, GetUserReviewsInformat
         flag, user = self.check_perms(request, {"username": username})
         if not user:
             raise Http404
-        image, user_settings = get_user_avatar_path(user)
-        return context | self.get_user_reviews_info(request.user, user) | {
+        image, user_settings = get_user_avatar_path(user, PROFILE_AVATAR_VARIANT_SIZE)
+        return context | self.get_user_reviews_info(user, flag if isinstance(flag, Review) else None) | {
             "user": user,
             "image": image,
             "user_signature": user_settings.signature,
-            "any_random_integer": randrange(100000),
             "show_active": "active" if request.user == user else "",
             "form": not isinstance(flag, E),
             "show_success": request.GET.get("show_success", False),
@@ -84,7 +82,7 @@ class RegisterViewUtils(object):
             user = form.save()
             UserSettings.objects.create(user=user)
             UserRating.objects.create(user=user)
-            cache.delete(settings.LAST_JOINED_CACHE_NAME)
+            invalidate_forum_stats()
             return redirect(f"{reverse('home_app:auth')}?show_success=True")
 
         return view_self.get(request, True, request.POST)
@@ -1,21 +1,18 @@
 from __future__ import annotations
 
-from typing import Dict, Literal, NamedTuple, Optional, Tuple, Union
+from typing import Dict, Literal, NamedTuple, Optional, Tuple, Union, cast
 
 from django.contrib.auth.models import AnonymousUser, User
-from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import F
 from django.http import HttpRequest
 from rest_framework.request import Request
 
 from error_messages.home_error_messages import Ratings
 from home_app.models import Review, UserRating
-from schemora.cache import get_cache_name_delimiter, get_user_settings_cache_name
 from schemora.core.datastructures import Setting
 from schemora.core.enums import RequestHost
 from schemora.core.types import E, ErrorMessage
-from schemora.settings.helpers import get_user_settings_model
+from schemora.settings.helpers import get_user_settings_model, invalidate_user_settings
 from services.user_settings import settings
 
 UserSettings = get_user_settings_model()
@@ -45,7 +42,7 @@ class UpdateSettingsMixin(object):
     request_host: RequestHost = None
 
     def update_settings(self, user: User | AnonymousUser, post: Dict, files: Dict) -> UpdateSettingsReturn:
-        flag_success, user_settings = False, UserSettings.objects.select_related("user").get(user=user)
+        flag_success, user_settings = False, UserSettings.objects.get(user=user)
 
         for setting in settings:
             flag = self._process_setting(setting, user_settings, post, files)
@@ -62,8 +59,7 @@ class UpdateSettingsMixin(object):
             if setting.handler.handler().handle(setting, user_settings, post=post, files=files,
                                                 request_host=self.request_host):
                 return ProcessSettingReturn(True, setting.error.error_message)
-            delimiter = get_cache_name_delimiter()
-            cache.delete(f"{user_settings.user.pk}{delimiter}{get_user_settings_cache_name()}")
+            invalidate_user_settings(user_settings.user_id)
             return ProcessSettingReturn(False, True)
         return ProcessSettingReturn(False, False)
 
@@ -74,14 +70,18 @@ class _ReviewOperationPermissionsMixin:
     добавление/изменение/удаление отзыва на другого форумчанина.
     """
 
-    def check_perms(self, request: HttpRequest | Request, user_identifier: Dict) \
+    def check_perms(self, request: HttpRequest | Request, user_identifier: Dict, with_review: bool = True) \
             -> Tuple[Review | Literal[None], User] | Tuple[E, Literal[False] | User]:
+        """ С with_review=False отзыв текущего пользователя не загружается (вместо него возвращается None). """
+
         try:
             user = User.objects.get(**user_identifier)
         except (ObjectDoesNotExist, ValueError):
             return E(2), False
         if not request.user.is_authenticated or request.user == user:
             return E(1), user
+        if not with_review:
+            return None, user
         return Review.objects.filter(reviewer=request.user, user=user).first(), user
 
 
@@ -90,18 +90,13 @@ class AddReviewMixin(_ReviewOperationPermissionsMixin):
 
     def add_review(self, request: HttpRequest | Request, user_identifier: Dict, like: Optional[bool] = True) \
             -> Tuple[Literal[None] | E, User | Literal[False]]:
-        flag, user = self.check_perms(request, user_identifier)
+        flag, user = self.check_perms(request, user_identifier, with_review=False)
         if isinstance(flag, E):
             return flag, user
-        review, created = (flag, False) if flag else (Review.objects.create(reviewer=request.user, user=user), True)
-        user_reviews, _ = UserRating.objects.get_or_create(user=user)
-        if review.feedback == like:
+        # Прежний отзыв читается и заменяется в одной транзакции (ReviewManager.upsert).
+        # Без ошибки check_perms отзыв пишет аутентифицированный пользователь на существующего.
+        if not Review.objects.upsert(cast(User, request.user), cast(User, user), like):
             return E(3), user
-        update_value = 1 if created else 2
-        review.feedback, user_reviews.rating = (like, (F("rating") + update_value)
-                                                if like else (F("rating") - update_value))
-        review.save(update_fields=["feedback", "time_added"])
-        user_reviews.save(update_fields=["rating"])
         return None, user
 
 
@@ -110,16 +105,11 @@ class DropReviewMixin(_ReviewOperationPermissionsMixin):
 
     def drop_review(self, request: HttpRequest | Request, user_identifier: Dict, **kwargs) \
             -> Tuple[Literal[None] | E, User | Literal[False]]:
-        flag, user = self.check_perms(request, user_identifier)
+        flag, user = self.check_perms(request, user_identifier, with_review=False)
         if isinstance(flag, E):
             return flag, user
-        if not flag:
+        if not Review.objects.drop(cast(User, request.user), cast(User, user)):
             return E(4), user
-        review, user_reviews, _ = flag, *UserRating.objects.get_or_create(user=user)
-        update_value = -1 if review.feedback else 1
-        user_reviews.rating = F("rating") + update_value
-        user_reviews.save(update_fields=["rating"])
-        review.delete()
         return None, user
 
 
@@ -129,10 +119,14 @@ class GetUserReviewsInformationMixin(object):
     и отзыве текущего юзера на запрашиваемого камрада.
     """
 
-    def get_user_reviews_info(self, reviewer: User | AnonymousUser, user: User) -> Dict:
-        like = Review.objects.filter(reviewer=reviewer, user=user).first() if reviewer.is_authenticated else None
+    def get_user_reviews_info(self, user: User, review: Review | Literal[None]) -> Dict:
+        """ review - отзыв текущего юзера на камрада, уже полученный методом check_perms. """
+
+        user_rating = UserRating.objects.get_for_user(user)
         return {
-            "user_rating": UserRating.objects.get(user=user).rating,
-            "reviews_count": Review.objects.filter(user=user).count(),
-            "like": ("Лайк" if like.feedback else "Дизлайк") if like else None,
+            "user_rating": user_rating.rating,
+            "reviews_count": user_rating.reviews_count,
+            "likes": user_rating.likes,
+            "dislikes": user_rating.dislikes,
+            "like": ("Лайк" if review.feedback else "Дизлайк") if review else None,
         }
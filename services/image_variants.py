@@ -0,0 +1,441 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from math import ceil
+from multiprocessing import current_process
+from typing import Dict, Iterable, Iterator, List, Literal, NamedTuple, Optional, Sequence, Tuple, Type
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import Model
+from django.db.models.signals import pre_save
+from PIL import Image, ImageOps
+from PIL.Image import Image as Im
+
+from schemora.conf import schemora_settings
+from schemora.settings.helpers import get_upload_crop_path, get_user_settings_model, invalidate_user_settings
+
+logger = logging.getLogger(__name__)
+
+UserSettings = get_user_settings_model()
+
+# Размеры вариантов, которые запрашивают шаблоны: аватар рядом с сообщением (175px), вложение (200px)
+# и аватар в профиле (250px). Для вложения и профиля берется больший вариант, чтобы не растягивать меньший.
+AVATAR_VARIANT_SIZE = 175
+UPLOAD_VARIANT_SIZE = 400
+PROFILE_AVATAR_VARIANT_SIZE = 400
+
+# Версия формата манифеста вариантов. Манифест другой версии считается отсутствующим.
+VARIANTS_MANIFEST_VERSION = 1
+
+# Форматы вариантов: расширение файла -> формат PIL и параметры сохранения. exif, icc_profile
+# и xmp не передаются, поэтому метаданные исходного изображения в варианты не попадают.
+VARIANT_FORMATS: Dict[str, Tuple[str, Dict]] = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+# Загрузки, для которых хранится версия содержимого (поле <поле загрузки>_version): модель -> поле загрузки.
+VERSIONED_UPLOAD_FIELDS: Dict[str, str] = {
+    "forum_app.Topic": "upload",
+    "forum_app.Comment": "upload",
+    UserSettings._meta.label: "avatar",
+}
+UPLOAD_VERSION_LENGTH = 12
+
+# Файлы, получаемые из загрузок: обрезанное изображение (_crop), варианты (_crop_<размер>),
+# манифест вариантов и временные файлы вариантов и манифеста.
+DERIVED_FILE_RE = re.compile(r"_crop(_\d+)?\.\w+(\.tmp)?$|_variants\.json(\.tmp)?$")
+
+
+class ImageTooLarge(ValueError):
+    """ Изображение больше допустимого количества пикселей (IMAGE_MAX_PIXELS, IMAGE_MAX_DECODED_PIXELS). """
+
+
+class BatchResult(NamedTuple):
+    """ Итог пакетной обработки: количество обработанных изображений и ошибки по путям. """
+
+    processed: int
+    failed: Dict[str, str]
+
+
+class VariantFile(NamedTuple):
+    """ Созданный файл варианта. path - относительно MEDIA_ROOT. """
+
+    size: int
+    extension: str
+    path: str
+    width: int
+    height: int
+    bytes: int
+
+
+class VariantsManifest(NamedTuple):
+    """ Манифест вариантов изображения: лежит рядом с исходным файлом (<имя>_variants.json). """
+
+    version: int
+    source: str
+    variants: List[VariantFile]
+
+
+def get_media_name(path: str) -> str:
+    """ Путь файла относительно MEDIA_ROOT по абсолютному пути или по пути относительно MEDIA_ROOT. """
+
+    return os.path.relpath(path, os.path.abspath(settings.MEDIA_ROOT)) if os.path.isabs(path) else path
+
+
+def get_variants_manifest_path(name: str) -> str:
+    """ Путь манифеста вариантов: <имя>_<расширение>_variants.json, как и у вариантов (get_upload_crop_path). """
+
+    head, _, filename = name.rpartition("/")
+    return "/".join(filter(None, (head, f"{'_'.join(filename.rsplit('.', 1))}_variants.json")))
+
+
+def get_legacy_variants_manifest_path(name: str) -> str:
+    """ Путь манифеста без расширения исходного файла в имени: общий у 5.png и 5.jpg. """
+
+    head, _, filename = name.rpartition("/")
+    return "/".join(filter(None, (head, f"{filename.rsplit('.', 1)[0]}_variants.json")))
+
+
+def read_variants_manifest(path: str, legacy: bool = False) -> Optional[VariantsManifest]:
+    name = get_media_name(path)
+    manifest_path = get_legacy_variants_manifest_path(name) if legacy else get_variants_manifest_path(name)
+    try:
+        with open(default_storage.path(manifest_path)) as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("version") != VARIANTS_MANIFEST_VERSION:
+        return None
+    return VariantsManifest(data["version"], data["source"], [VariantFile(**v) for v in data["variants"]])
+
+
+def write_variants_manifest(manifest: VariantsManifest) -> Literal[None]:
+    path = default_storage.path(get_variants_manifest_path(manifest.source))
+    data = manifest._asdict() | {"variants": [variant._asdict() for variant in manifest.variants]}
+    # Манифест заменяется атомарно: читатель видит либо прежний, либо новый.
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(data, file)
+    os.replace(f"{path}.tmp", path)
+    return None
+
+
+def get_expected_variant_paths(name: str) -> List[str]:
+    """ Пути вариантов, которые должны быть у изображения при текущих IMAGE_VARIANT_SIZES и VARIANT_FORMATS. """
+
+    return [get_upload_crop_path(name, size, extension)
+            for size in sorted(settings.IMAGE_VARIANT_SIZES, reverse=True) for extension in VARIANT_FORMATS]
+
+
+def is_image_variants_stale(path: str) -> bool:
+    """
+    Проверка, нужно ли (пере)создать варианты изображения: манифеста нет или он другой версии,
+    варианты созданы для других размеров или форматов, исходный файл новее манифеста
+    или какого-то файла варианта нет.
+    """
+
+    name = get_media_name(path)
+    manifest = read_variants_manifest(name)
+    expected = get_expected_variant_paths(name)
+    if manifest is None or {variant.path for variant in manifest.variants} != set(expected):
+        return True
+    try:
+        if os.path.getmtime(default_storage.path(name)) > \
+                os.path.getmtime(default_storage.path(get_variants_manifest_path(name))):
+            return True
+    except OSError:
+        return True
+    return not all(os.path.exists(default_storage.path(variant_path)) for variant_path in expected)
+
+
+def get_upload_directories() -> Tuple[str, ...]:
+    return settings.CUSTOM_TOPIC_UPLOADS_DIR, settings.CUSTOM_COMMENT_UPLOADS_DIR, settings.CUSTOM_USER_AVATARS_DIR
+
+
+def _scan_sorted(directory: str) -> Iterator[str]:
+    # Имена каталогов сравниваются с завершающим "/", поэтому пути выдаются в порядке сравнения строк.
+    try:
+        entries = sorted(os.scandir(directory), key=lambda e: f"{e.name}/" if e.is_dir() else e.name)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir():
+            yield from _scan_sorted(entry.path)
+        elif entry.is_file() and not DERIVED_FILE_RE.search(entry.name):
+            yield entry.path
+
+
+def find_upload_images(directories: Optional[Iterable[str]] = None) -> Iterator[str]:
+    """
+    Функция для обхода исходных изображений загрузок (пути относительно MEDIA_ROOT) в каталогах
+    directories (по умолчанию каталоги вложений тем, комментариев и аватаров) без производных файлов.
+    Пути выдаются по возрастанию, поэтому обход можно продолжить с последнего обработанного пути.
+    """
+
+    for directory in sorted(directories or get_upload_directories()):
+        for path in _scan_sorted(default_storage.path(directory)):
+            yield get_media_name(path)
+
+
+def get_center_crop_box(width: int, height: int) -> Tuple[int, int, int, int]:
+    side = min(width, height)
+    left, top = (width - side) // 2, (height - side) // 2
+    return left, top, left + side, top + side
+
+
+def check_image_pixels(source: Im, size: int, draft: bool = True) -> Literal[None]:
+    """
+    Функция для проверки количества пикселей изображения без его декодирования: по заголовку
+    и после выбора масштаба декодирования (JPEG в режиме draft - в 2-8 раз меньше, не меньше size).
+    """
+
+    width, height = source.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f"Image {width}x{height} exceeds IMAGE_MAX_PIXELS")
+    if draft and source.format == "JPEG":
+        scale = size / min(width, height)
+        source.draft(source.mode, (ceil(width * scale), ceil(height * scale)))
+    if source.width * source.height > settings.IMAGE_MAX_DECODED_PIXELS:
+        raise ImageTooLarge(f"Image {source.width}x{source.height} exceeds IMAGE_MAX_DECODED_PIXELS")
+    return None
+
+
+def validate_image_pixels(file: File) -> Literal[None]:
+    """
+    Валидатор загружаемого изображения (формы и сериализаторы): те же ограничения пикселей,
+    что и при создании вариантов, поэтому принятая загрузка всегда получает варианты.
+    Неверные изображения отклоняет само поле изображения.
+    """
+
+    try:
+        with Image.open(file) as source:
+            check_image_pixels(source, max(settings.IMAGE_VARIANT_SIZES))
+    except (ImageTooLarge, Image.DecompressionBombError) as error:
+        raise ValidationError(str(error), code="image_too_large") from None
+    except OSError:
+        return None
+    finally:
+        file.seek(0)
+    return None
+
+
+def load_image(source: Im, size: int, draft: bool = True) -> Im:
+    """
+    Функция для декодирования изображения, из которого будет получен центрированный квадрат size x size.
+    Количество пикселей проверяется до декодирования (check_image_pixels).
+    """
+
+    check_image_pixels(source, size, draft)
+    img = ImageOps.exif_transpose(source)
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    img.info = dict()
+    return img
+
+
+def _to_jpeg_mode(img: Im) -> Im:
+    if img.mode != "RGBA":
+        return img
+    background = Image.new("RGB", img.size, (255, 255, 255))
+    background.paste(img, mask=img.getchannel("A"))
+    return background
+
+
+def build_image_variants(path: str, sizes: Optional[Sequence[int]] = None, draft: bool = True) \
+        -> VariantsManifest:
+    """
+    Функция для создания вариантов изображения: центрированный квадрат каждого размера из sizes
+    (по умолчанию IMAGE_VARIANT_SIZES) в каждом формате VARIANT_FORMATS. Изображения меньше
+    размера варианта не увеличиваются. Созданные варианты записываются в манифест.
+    Из исходного изображения получается только наибольший вариант (с уменьшением при декодировании),
+    остальные - из него.
+    """
+
+    name = get_media_name(path)
+    previous = read_variants_manifest(name)
+    sizes = sorted(sizes or settings.IMAGE_VARIANT_SIZES, reverse=True)
+    with Image.open(default_storage.path(name)) as source:
+        img = load_image(source, sizes[0], draft)
+    box = get_center_crop_box(*img.size)
+    side = min(sizes[0], box[2] - box[0])
+    img = img.resize((side, side), Image.Resampling.LANCZOS, box=box, reducing_gap=3.0)
+
+    variants = list()
+    for size in sizes:
+        resized = img if img.width <= size else img.resize((size, size), Image.Resampling.LANCZOS)
+        for extension, (image_format, options) in VARIANT_FORMATS.items():
+            variant = _to_jpeg_mode(resized) if image_format == "JPEG" else resized
+            variant_name = get_upload_crop_path(name, size, extension)
+            variant_path = default_storage.path(variant_name)
+            # Файл варианта заменяется атомарно: параллельный запрос не получит его недописанным.
+            variant.save(f"{variant_path}.tmp", image_format, **options)
+            os.replace(f"{variant_path}.tmp", variant_path)
+            variants.append(VariantFile(size, extension, variant_name, variant.width, variant.height,
+                                        os.path.getsize(variant_path)))
+
+    manifest = VariantsManifest(VARIANTS_MANIFEST_VERSION, name, variants)
+    write_variants_manifest(manifest)
+    # Варианты размеров и форматов, которых больше нет в настройках, удаляются после записи нового манифеста.
+    if previous is not None:
+        _remove_media_files({variant.path for variant in previous.variants} - {v.path for v in variants})
+    delete_legacy_image_variants(name)
+    return manifest
+
+
+def _build_image_variants_safely(path: str) -> Optional[str]:
+    # Ошибка одного изображения не прерывает пакет: она возвращается вместо исключения.
+    try:
+        build_image_variants(path)
+    except Exception as error:
+        logger.exception("Image variants of %s were not built.", path)
+        return f"{error.__class__.__name__}: {error}"
+    return None
+
+
+def iter_image_variants_batches(batches: Iterable[Sequence[str]], processes: Optional[int] = None) \
+        -> Iterator[BatchResult]:
+    """
+    Функция для создания вариантов изображений пакетами в одном пуле из processes процессов
+    (по умолчанию IMAGE_BATCH_PROCESSES): итог пакета выдается, когда обработан весь пакет.
+    С одним процессом, или если пул нельзя создать (например, в daemon-процессе воркера),
+    изображения обрабатываются по очереди в текущем процессе.
+    """
+
+    processes = processes or settings.IMAGE_BATCH_PROCESSES
+    if processes > 1 and current_process().daemon:
+        logger.warning("Image variants are built sequentially: %s is a daemon process and cannot start "
+                       "a pool of %d processes.", current_process().name, processes)
+        processes = 1
+    pool = ProcessPoolExecutor(processes) if processes > 1 else None
+    try:
+        for paths in batches:
+            paths, errors = list(paths), None
+            if pool is not None and len(paths) > 1:
+                try:
+                    errors = list(pool.map(_build_image_variants_safely, paths, chunksize=4))
+                except (AssertionError, OSError):
+                    logger.warning("Process pool is unavailable, image variants are built sequentially.")
+                    pool.shutdown()
+                    pool = None
+            if errors is None:
+                errors = [_build_image_variants_safely(path) for path in paths]
+            failed = {path: error for path, error in zip(paths, errors) if error is not None}
+            yield BatchResult(len(paths) - len(failed), failed)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def build_image_variants_batch(paths: Iterable[str], processes: Optional[int] = None) -> BatchResult:
+    """ Функция для создания вариантов многих изображений в пуле из processes процессов (одним пакетом). """
+
+    paths = list(paths)
+    return next(iter_image_variants_batches((paths,), min(processes or settings.IMAGE_BATCH_PROCESSES,
+                                                          max(len(paths), 1))))
+
+
+def backfill_upload_versions() -> int:
+    """
+    Функция для заполнения версий содержимого загрузок, сохраненных до их появления.
+    Объекты сохраняются только с полем версии, поэтому фрагменты страниц с их ссылками обновляются
+    обработчиками post_save. Загрузки без файла пропускаются. Возвращает количество заполненных версий.
+    """
+
+    filled = 0
+    for label, field in VERSIONED_UPLOAD_FIELDS.items():
+        model, version_field = apps.get_model(label), f"{field}_version"
+        queryset = model.objects.filter(**{version_field: ""}).exclude(**{f"{field}__isnull": True}).exclude(
+            **{f"{field}__in": ("", str(schemora_settings.USER_SETTINGS.DEFAULT_USER_AVATAR_FILENAME))}
+        )
+        for instance in queryset.iterator(chunk_size=500):
+            try:
+                with default_storage.open(getattr(instance, field).name) as file:
+                    setattr(instance, version_field, get_content_version(file))
+            except OSError:
+                continue
+            instance.save(update_fields=[version_field])
+            if model is UserSettings:
+                invalidate_user_settings(instance.user_id)
+            filled += 1
+    return filled
+
+
+def get_content_version(file: File) -> str:
+    """ Версия содержимого файла для его URL и URL его вариантов: начало sha256 содержимого. """
+
+    digest = sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()[:UPLOAD_VERSION_LENGTH]
+
+
+def _set_upload_version(sender: Type[Model], instance: Model, update_fields: Optional[Iterable[str]] = None,
+                        **kwargs) -> Literal[None]:
+    # Версия вычисляется до сохранения файла, пока загруженный файл еще не записан в хранилище (_committed).
+    field = VERSIONED_UPLOAD_FIELDS[sender._meta.label]
+    if update_fields is not None and field not in update_fields:
+        return None
+    upload = getattr(instance, field)
+    if not upload:
+        setattr(instance, f"{field}_version", "")
+    elif not upload._committed:
+        setattr(instance, f"{field}_version", get_content_version(upload))
+    return None
+
+
+def connect_signals() -> Literal[None]:
+    """ Подключение обработчиков, сохраняющих версию содержимого новых загрузок. """
+
+    for label in VERSIONED_UPLOAD_FIELDS:
+        pre_save.connect(_set_upload_version, sender=label, dispatch_uid=f"upload_version_{label}")
+    return None
+
+
+def delete_image_variants(path: str) -> int:
+    """ Удаление вариантов изображения из манифеста, самого манифеста и старого обрезанного изображения. """
+
+    name = get_media_name(path)
+    manifest = read_variants_manifest(name)
+    paths = [variant.path for variant in manifest.variants] if manifest else list()
+    paths += [get_variants_manifest_path(name), get_upload_crop_path(name)]
+    return _remove_media_files(paths) + delete_legacy_image_variants(name)
+
+
+def delete_legacy_image_variants(path: str) -> int:
+    """
+    Удаление вариантов из манифеста старого формата (имена без расширения исходного файла).
+    Манифест и варианты общие у 5.png и 5.jpg, поэтому удаляются, только если манифест записан для этого файла.
+    """
+
+    name = get_media_name(path)
+    manifest = read_variants_manifest(name, legacy=True)
+    if manifest is None or manifest.source != name:
+        return 0
+    return _remove_media_files([variant.path for variant in manifest.variants]
+                               + [get_legacy_variants_manifest_path(name)])
+
+
+def delete_uploads(names: Iterable[str]) -> int:
+    """ Удаление исходных файлов загрузок и их вариантов. Возвращает количество удаленных файлов. """
+
+    return sum(delete_image_variants(name) + _remove_media_files((name,)) for name in names)
+
+
+def _remove_media_files(names: Iterable[str]) -> int:
+    deleted = 0
+    for name in names:
+        try:
+            os.remove(default_storage.path(name))
+            deleted += 1
+        except FileNotFoundError:
+            continue
+    return deleted
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+from functools import wraps
+from hashlib import md5
+from typing import Callable, Dict, Literal, NamedTuple, Optional, Set, Type
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Model
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpRequest, HttpResponse
+
+from forum_app.models import Comment, Topic
+from schemora.cache import CacheNamespace
+from services.topic_fragments import bump_topic_fragments_versions, get_topic_fragments_version
+from services.views_buffer import get_views_buffer
+
+View = Callable[..., HttpResponse]
+
+# Поколение страниц со списками тем.
+forum_pages_cache = CacheNamespace(settings.FORUM_PAGES_VERSION_CACHE_NAME)
+
+# Имена вьюшек, обернутых anonymous_page_cache, для отчета о попаданиях в кэш.
+cached_views: Set[str] = set()
+
+
+class CachedPage(NamedTuple):
+    content: bytes
+    content_type: str
+
+
+class PageCacheStats(NamedTuple):
+    hits: int
+    misses: int
+
+
+def get_forum_pages_version(*args, **kwargs) -> int:
+    """
+    Версия страниц со списками тем (главная форума, разделы, поиск). Меняется при добавлении,
+    изменении и удалении любой темы или комментария.
+    """
+
+    return forum_pages_cache.get_generation()
+
+
+def get_topic_page_version(request: HttpRequest, section: str, ids: int) -> int:
+    """ Версия страницы темы - версия ее фрагментов (services.topic_fragments). """
+
+    return get_topic_fragments_version(ids)
+
+
+def count_topic_view(request: HttpRequest, section: str, ids: int) -> Literal[None]:
+    """ Страница темы из кэша тоже считается просмотром. """
+
+    get_views_buffer().increment(ids)
+    return None
+
+
+def is_page_cacheable(request: HttpRequest) -> bool:
+    """ Кэшируются только GET запросы без сессии: у таких читателей нет персональных данных на странице. """
+
+    return request.method == "GET" and settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def get_page_cache_key(view_name: str, version: int, request: HttpRequest) -> str:
+    path = md5(request.get_full_path().encode()).hexdigest()
+    return f"{settings.FORUM_PAGE_CACHE_NAME}:{view_name}:{version}:{path}"
+
+
+def _get_stats_key(view_name: str, hit: bool) -> str:
+    return f"{settings.FORUM_PAGE_CACHE_NAME}:stats:{view_name}:{'hits' if hit else 'misses'}"
+
+
+def _record(view_name: str, hit: bool) -> Literal[None]:
+    key = _get_stats_key(view_name, hit)
+    if not cache.add(key, 1, timeout=None):
+        cache.incr(key)
+    return None
+
+
+def get_page_cache_stats() -> Dict[str, PageCacheStats]:
+    """ Количество попаданий и промахов кэша страниц по вьюшкам (одним cache.get_many). """
+
+    keys = {_get_stats_key(name, hit) for name in cached_views for hit in (True, False)}
+    values = cache.get_many(keys)
+    return {name: PageCacheStats(values.get(_get_stats_key(name, True), 0), values.get(_get_stats_key(name, False), 0))
+            for name in sorted(cached_views)}
+
+
+def reset_page_cache_stats() -> Literal[None]:
+    cache.delete_many([_get_stats_key(name, hit) for name in cached_views for hit in (True, False)])
+    return None
+
+
+def anonymous_page_cache(get_version: Callable[..., int], on_hit: Optional[Callable[..., None]] = None) \
+        -> Callable[[View], View]:
+    """
+    Декоратор кэша страниц для анонимных читателей. Ключ - имя вьюшки, версия данных страницы
+    (get_version вызывается с аргументами вьюшки) и URL со строкой запроса. Кэшируются только
+    ответы 200 без cookies. on_hit вызывается с аргументами вьюшки при отдаче страницы из кэша.
+    В заголовке X-Page-Cache возвращается hit или miss.
+    """
+
+    def decorator(view: View) -> View:
+        view_name = view.__name__
+        cached_views.add(view_name)
+
+        @wraps(view)
+        def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            if not is_page_cacheable(request):
+                return view(request, *args, **kwargs)
+            key = get_page_cache_key(view_name, get_version(request, *args, **kwargs), request)
+            page: Optional[CachedPage] = cache.get(key)
+            _record(view_name, hit=page is not None)
+            if page is not None:
+                if on_hit is not None:
+                    on_hit(request, *args, **kwargs)
+                response = HttpResponse(page.content, content_type=page.content_type)
+                response["X-Page-Cache"] = "hit"
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                cache.set(key, CachedPage(response.content, response["Content-Type"]),
+                          settings.FORUM_PAGE_CACHE_TIMEOUT)
+            response["X-Page-Cache"] = "miss"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _bump_forum_pages_version(sender: Type[Model], instance: Model, **kwargs) -> Literal[None]:
+    # Как и версии фрагментов тем, версия меняется после фиксации транзакции записи.
+    transaction.on_commit(forum_pages_cache.invalidate)
+    return None
+
+
+def bump_instance_pages_versions(instance: Topic | Comment) -> Literal[None]:
+    """
+    Смена версий страниц со списками тем и фрагментов темы объекта после его изменения без сигналов
+    сохранения (например, переименования вложения в forum_app.models.rename_temporary_upload).
+    """
+
+    bump_topic_fragments_versions((instance.topic_id if isinstance(instance, Comment) else instance.pk,))
+    forum_pages_cache.invalidate()
+    return None
+
+
+def connect_signals() -> Literal[None]:
+    """ Подключение обработчиков, меняющих версию страниц со списками тем. """
+
+    for model in (Topic, Comment):
+        post_save.connect(_bump_forum_pages_version, sender=model, dispatch_uid=f"forum_pages_{model.__name__}_save")
+        post_delete.connect(_bump_forum_pages_version, sender=model,
+                            dispatch_uid=f"forum_pages_{model.__name__}_delete")
+    return None
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+from typing import Any, List, Literal, NamedTuple, Optional, Sequence, Tuple
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Field, Model, Q, QuerySet
+
+Cursor = str
+Ordering = Tuple[str, ...]
+
+# Порядок по умолчанию для списков тем: сначала новые. 'id' разрешает совпадения по времени.
+DEFAULT_KEYSET_ORDERING: Ordering = ("-time_added", "-id")
+
+
+class KeysetPage(NamedTuple):
+    """ Страница объектов, полученная keyset-пагинацией, и курсоры соседних страниц. """
+
+    objects: List
+    next_cursor: Optional[Cursor]
+    previous_cursor: Optional[Cursor]
+
+
+class CursorPosition(NamedTuple):
+    """ Раскодированный курсор: значения полей сортировки граничного объекта и направление перехода. """
+
+    values: List[Any]
+    reverse: bool = False
+
+
+def encode_cursor(position: CursorPosition) -> Cursor:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in position.values]
+    raw = json.dumps([values, int(position.reverse)], separators=(",", ":"))
+    return urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _get_ordering_field(queryset: QuerySet, name: str) -> Field:
+    if name == "pk":
+        return queryset.model._meta.pk
+    try:
+        return queryset.model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return queryset.query.annotations[name].output_field
+
+
+def decode_cursor(cursor: Optional[Cursor], ordering: Ordering, queryset: QuerySet) -> CursorPosition | Literal[None]:
+    """
+    Функция для раскодирования курсора. Значения приводятся к типам полей сортировки queryset'а,
+    невалидный курсор (в т.ч. подделанный) считается отсутствующим (первая страница).
+    """
+
+    if not cursor:
+        return None
+    try:
+        values, reverse = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(ordering) or None in values:
+            return None
+        values = [_get_ordering_field(queryset, field.lstrip("-")).to_python(value)
+                  for field, value in zip(ordering, values)]
+    except (ValueError, TypeError, KeyError, BinasciiError, ValidationError):
+        return None
+    if None in values:
+        return None
+    return CursorPosition(values, bool(reverse))
+
+
+def _get_position(obj: Model, ordering: Ordering, reverse: bool) -> CursorPosition:
+    return CursorPosition([getattr(obj, field.lstrip("-")) for field in ordering], reverse)
+
+
+def _get_seek_query(ordering: Ordering, position: CursorPosition) -> Q:
+    """
+    Функция для построения условия "строго после курсора" для составного ключа сортировки:
+    (a < x) OR (a = x AND b < y) OR ...
+    """
+
+    query, equal = Q(), Q()
+    for field, value in zip(ordering, position.values):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") != position.reverse else "gt"
+        query |= equal & Q(**{f"{name}__{lookup}": value})
+        equal &= Q(**{name: value})
+    return query
+
+
+def _reverse_ordering(ordering: Sequence[str]) -> Ordering:
+    return tuple(field[1:] if field.startswith("-") else f"-{field}" for field in ordering)
+
+
+def paginate_keyset(queryset: QuerySet, cursor: Optional[Cursor], page_size: int = 20,
+                    ordering: Ordering = DEFAULT_KEYSET_ORDERING) -> KeysetPage:
+    """
+    Функция для получения страницы объектов по курсору. Вместо OFFSET и подсчета всех строк
+    делается один индексируемый запрос на page_size + 1 строк, поэтому стоимость страницы
+    не зависит от ее глубины.
+    """
+
+    position = decode_cursor(cursor, ordering, queryset)
+    if position:
+        queryset = queryset.filter(_get_seek_query(ordering, position))
+    reverse = bool(position and position.reverse)
+    objects = list(queryset.order_by(*(_reverse_ordering(ordering) if reverse else ordering))[:page_size + 1])
+    has_more = len(objects) > page_size
+    objects = objects[:page_size]
+    if reverse:
+        objects.reverse()
+    if not objects:
+        return KeysetPage(objects, None, None)
+
+    has_next, has_previous = (True, has_more) if reverse else (has_more, position is not None)
+    return KeysetPage(
+        objects,
+        encode_cursor(_get_position(objects[-1], ordering, False)) if has_next else None,
+        encode_cursor(_get_position(objects[0], ordering, True)) if has_previous else None,
+    )
@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from functools import lru_cache, reduce
+from operator import add, and_
+from threading import RLock
+from typing import Dict, Iterable, List, Literal, Optional, Sequence, Set, Tuple, Type
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField
+from django.db import transaction
+from django.db.models import F, FloatField, Func, Q, QuerySet, Value
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils.module_loading import import_string
+
+from error_messages.forum_error_messages import ModelField
+from forum_app.models import Topic
+from schemora.cache import CacheNamespace
+from services.pagination import Ordering
+
+
+class BaseSearchBackend(ABC):
+    """
+    Шаблон поискового бэкенда тем. Каждый поисковый терм должен найтись хотя бы в одном
+    из выбранных полей (SearchParamsExpressions.Params), найденные темы - пересечение по термам.
+    """
+
+    # Порядок выдачи найденных тем. None - оставить порядок списка без изменений.
+    ordering: Optional[Ordering] = None
+
+    @abstractmethod
+    def filter_queryset(self, queryset: QuerySet, terms: Sequence[str], fields: Sequence[ModelField]) -> QuerySet:
+        """ Метод для фильтрации queryset'а тем. Вызывается только с непустыми terms и fields. """
+
+        raise NotImplementedError()
+
+    def connect_signals(self) -> Literal[None]:
+        """ Подключение обработчиков сигналов, поддерживающих индекс бэкенда в актуальном состоянии. """
+
+        return None
+
+    def warm_up(self) -> Literal[None]:
+        """ Подготовка индекса при старте воркера. """
+
+        return None
+
+    def rebuild(self) -> int:
+        """ Полное перестроение индекса бэкенда. Возвращает количество проиндексированных тем. """
+
+        return 0
+
+
+class ORMSearchBackend(BaseSearchBackend):
+    """ Поисковый бэкенд по умолчанию: цепочка OR из icontains по выбранным полям. """
+
+    def filter_queryset(self, queryset: QuerySet, terms: Sequence[str], fields: Sequence[ModelField]) -> QuerySet:
+        for term in terms:
+            queryset = queryset.filter(reduce(lambda q, f: q | Q(**{f"{f}__icontains": term}), fields, Q()))
+        return queryset
+
+
+class PostgresFullTextSearchBackend(ORMSearchBackend):
+    """
+    Полнотекстовый поиск PostgreSQL по взвешенному tsvector столбцу Topic.search_vector
+    (название весомее вопроса) с GIN индексом. Результаты ранжируются по ts_rank.
+    Поиск по юзернейму остается icontains, т.к. юзернейм не входит в tsvector.
+    """
+
+    ordering = ("-search_rank", "-time_added", "-id")
+    vector_weights: Dict[ModelField, str] = {"title": "A", "question": "B"}
+
+    def __init__(self):
+        self.config = getattr(settings, "FORUM_SEARCH_CONFIG", "russian")
+
+    def get_search_vector(self) -> SearchVector:
+        vectors = (SearchVector(f, weight=w, config=self.config) for f, w in self.vector_weights.items())
+        return reduce(add, vectors)
+
+    def filter_queryset(self, queryset: QuerySet, terms: Sequence[str], fields: Sequence[ModelField]) -> QuerySet:
+        weights = [self.vector_weights[f] for f in fields if f in self.vector_weights]
+        other_fields = [f for f in fields if f not in self.vector_weights]
+        if not weights:
+            return super().filter_queryset(queryset, terms, fields).annotate(
+                search_rank=Value(0.0, output_field=FloatField())
+            )
+
+        query = reduce(and_, (SearchQuery(t, config=self.config, search_type="websearch") for t in terms))
+        vector: F | Func = F("search_vector")
+        condition = Q(search_vector=query)
+        if len(weights) < len(self.vector_weights):
+            # Совпадение по полному вектору позволяет использовать GIN индекс, ts_filter уточняет его по весам.
+            vector = Func(vector, Value("{%s}" % ",".join(w.lower() for w in weights)), function="ts_filter",
+                          output_field=SearchVectorField())
+            condition &= Q(search_document=query)
+        queryset = queryset.alias(search_document=vector).annotate(search_rank=SearchRank(vector, query))
+        if other_fields:
+            condition |= reduce(and_, (reduce(lambda q, f: q | Q(**{f"{f}__icontains": t}), other_fields, Q())
+                                       for t in terms))
+        return queryset.filter(condition)
+
+    def connect_signals(self) -> Literal[None]:
+        post_save.connect(self._update_search_vector, sender=Topic, dispatch_uid="topic_search_vector_update")
+        return None
+
+    def _update_search_vector(self, sender: Type[Topic], instance: Topic,
+                              update_fields: Optional[Sequence[str]] = None, **kwargs) -> Literal[None]:
+        if update_fields and not set(update_fields) & set(self.vector_weights):
+            return None
+        Topic.objects.filter(pk=instance.pk).update(search_vector=self.get_search_vector())
+        return None
+
+    def rebuild(self) -> int:
+        return Topic.objects.update(search_vector=self.get_search_vector())
+
+
+# Поколение индексов триграмм воркеров: меняется при изменении и удалении тем, а также при смене юзернейма.
+search_index_cache = CacheNamespace(settings.SEARCH_INDEX_VERSION_CACHE_NAME)
+
+
+class TrigramIndex(object):
+    """
+    Инвертированный индекс триграмм в памяти процесса: для каждого поля триграмма -> id тем.
+    Повторное добавление темы заменяет ее прежние триграммы, удаление - убирает их,
+    а кандидаты всегда проверяются на вхождение подстроки.
+    """
+
+    def __init__(self, fields: Sequence[ModelField]):
+        self.fields = tuple(fields)
+        self.documents: Dict[int, Tuple[str, ...]] = dict()
+        self.postings: Dict[ModelField, Dict[str, Set[int]]] = {field: dict() for field in self.fields}
+        self.max_pk = 0
+
+    @staticmethod
+    def get_trigrams(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, pk: int, values: Iterable[str]) -> Literal[None]:
+        self.remove(pk)
+        document = self.documents[pk] = tuple(str(value).lower() for value in values)
+        for field, text in zip(self.fields, document):
+            postings = self.postings[field]
+            for trigram in self.get_trigrams(text):
+                postings.setdefault(trigram, set()).add(pk)
+        self.max_pk = max(self.max_pk, pk)
+        return None
+
+    def remove(self, pk: int) -> Literal[None]:
+        document = self.documents.pop(pk, None)
+        if document is None:
+            return None
+        for field, text in zip(self.fields, document):
+            postings = self.postings[field]
+            for trigram in self.get_trigrams(text):
+                postings[trigram].discard(pk)
+                if not postings[trigram]:
+                    del postings[trigram]
+        return None
+
+    def search(self, term: str, fields: Sequence[ModelField]) -> Set[int]:
+        """ Поиск id тем, в выбранных полях которых встречается подстрока term (без учета регистра). """
+
+        term, found = term.lower(), set()
+        trigrams = self.get_trigrams(term)
+        for field in fields:
+            position = self.fields.index(field)
+            candidates: Iterable[int]
+            if trigrams:
+                postings = self.postings[field]
+                if any(trigram not in postings for trigram in trigrams):
+                    continue
+                rarest = min((postings[trigram] for trigram in trigrams), key=len)
+                candidates = rarest
+            else:
+                candidates = self.documents.keys()
+            for pk in candidates:
+                document = self.documents.get(pk)
+                if document is not None and term in document[position]:
+                    found.add(pk)
+        return found
+
+    def __len__(self):
+        return len(self.documents)
+
+
+class TrigramSearchBackend(BaseSearchBackend):
+    """
+    Поисковый бэкенд без особенностей PostgreSQL (dev, CI, edge): индекс триграмм в памяти воркера
+    по названию, вопросу и юзернейму автора. Строится при старте воркера (или при первом поиске),
+    обновляется сигналами сохранения/удаления тем, а перед поиском догружает темы, созданные
+    другими воркерами. Изменения и удаления тем в других воркерах видны по поколению индекса в кэше:
+    если оно сменилось, индекс перестраивается целиком. Поэтому поколение меняется, только если
+    индексируемые значения действительно изменились. Возвращает id найденных тем для обычного ORM queryset'а.
+    """
+
+    fields: Tuple[ModelField, ...] = ("title", "question", "author__username")
+    # Поля моделей, сохранение которых меняет индекс.
+    topic_fields = frozenset(("title", "question", "author", "author_id"))
+    user_fields = frozenset(("username",))
+
+    def __init__(self):
+        self.lock = RLock()
+        self.index: Optional[TrigramIndex] = None
+        # Поколение, с которым согласован индекс.
+        self.generation: Optional[int] = None
+
+    def filter_queryset(self, queryset: QuerySet, terms: Sequence[str], fields: Sequence[ModelField]) -> QuerySet:
+        return queryset.filter(pk__in=self.get_candidate_ids(terms, fields))
+
+    def get_candidate_ids(self, terms: Sequence[str], fields: Sequence[ModelField]) -> Set[int]:
+        fields = tuple(f for f in fields if f in self.fields)
+        with self.lock:
+            index = self._get_index()
+            found: Optional[Set[int]] = None
+            for term in terms:
+                ids = index.search(term, fields)
+                found = ids if found is None else found & ids
+            return found or set()
+
+    def connect_signals(self) -> Literal[None]:
+        pre_save.connect(self._remember_topic_values, sender=Topic, dispatch_uid="topic_trigram_index_remember")
+        post_save.connect(self._on_topic_save, sender=Topic, dispatch_uid="topic_trigram_index_save")
+        post_delete.connect(self._on_topic_delete, sender=Topic, dispatch_uid="topic_trigram_index_delete")
+        pre_save.connect(self._remember_username, sender=User, dispatch_uid="user_trigram_index_remember")
+        post_save.connect(self._on_user_save, sender=User, dispatch_uid="user_trigram_index_save")
+        return None
+
+    def warm_up(self) -> Literal[None]:
+        with self.lock:
+            self._get_index()
+        return None
+
+    def rebuild(self) -> int:
+        return len(self._build_index())
+
+    def _build_index(self) -> TrigramIndex:
+        # Поколение читается до загрузки тем: изменение во время загрузки приведет к повторной перестройке.
+        generation = search_index_cache.get_generation()
+        index = TrigramIndex(self.fields)
+        for pk, *values in self._get_values(Topic.objects.all()):
+            index.add(pk, values)
+        with self.lock:
+            self.index, self.generation = index, generation
+        return index
+
+    def _get_index(self) -> TrigramIndex:
+        index = self.index
+        if index is None or self.generation != search_index_cache.get_generation():
+            return self._build_index()
+        for pk, *values in self._get_values(Topic.objects.filter(pk__gt=index.max_pk)):
+            index.add(pk, values)
+        return index
+
+    def _get_values(self, queryset: QuerySet) -> Iterable[List]:
+        return queryset.order_by().values_list("pk", *self.fields).iterator(chunk_size=2000)
+
+    def _remember_topic_values(self, sender: Type[Topic], instance: Topic,
+                               update_fields: Optional[Iterable[str]] = None, **kwargs) -> Literal[None]:
+        # Индексируемые значения темы в базе до сохранения: с ними сравниваются сохраненные.
+        if instance._state.adding or (update_fields is not None and not self.topic_fields & set(update_fields)):
+            return None
+        instance.__dict__["_search_values"] = Topic.objects.filter(pk=instance.pk).values_list(*self.fields).first()
+        return None
+
+    def _remember_username(self, sender: Type[User], instance: User,
+                           update_fields: Optional[Iterable[str]] = None, **kwargs) -> Literal[None]:
+        if instance._state.adding or (update_fields is not None and not self.user_fields & set(update_fields)):
+            return None
+        instance.__dict__["_search_username"] = User.objects.filter(pk=instance.pk).values_list(
+            "username", flat=True).first()
+        return None
+
+    def _on_topic_save(self, sender: Type[Topic], instance: Topic, created: bool = False,
+                       update_fields: Optional[Iterable[str]] = None, **kwargs) -> Literal[None]:
+        if update_fields is not None and not self.topic_fields & set(update_fields):
+            return None
+        values = (instance.title, instance.question, instance.author.username)
+        # Сохранение без изменения названия, вопроса и автора не меняет индекс (и поколение).
+        if not created and instance.__dict__.pop("_search_values", None) == values:
+            return None
+        with self.lock:
+            if self.index is not None:
+                self.index.add(instance.pk, values)
+        # Новые темы другие воркеры догружают по id, а изменения - только по смене поколения.
+        return None if created else self._bump_generation_on_commit()
+
+    def _on_topic_delete(self, sender: Type[Topic], instance: Topic, **kwargs) -> Literal[None]:
+        with self.lock:
+            if self.index is not None:
+                self.index.remove(instance.pk)
+        return self._bump_generation_on_commit()
+
+    def _on_user_save(self, sender: Type[User], instance: User, created: bool = False,
+                      update_fields: Optional[Iterable[str]] = None, **kwargs) -> Literal[None]:
+        # Сохранение пользователя (например, last_login при входе или смена пароля) индекс не меняет,
+        # если не сменился юзернейм.
+        if created or (update_fields is not None and not self.user_fields & set(update_fields)):
+            return None
+        if instance.__dict__.pop("_search_username", None) == instance.username:
+            return None
+        with self.lock:
+            if self.index is not None:
+                for pk, *values in self._get_values(Topic.objects.filter(author=instance)):
+                    self.index.add(pk, values)
+        return self._bump_generation_on_commit()
+
+    @staticmethod
+    def _bump_generation_on_commit() -> Literal[None]:
+        transaction.on_commit(search_index_cache.invalidate)
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_search_backend() -> BaseSearchBackend:
+    """ Функция для ленивой загрузки поискового бэкенда, указанного в настройке FORUM_SEARCH_BACKEND. """
+
+    return import_string(getattr(settings, "FORUM_SEARCH_BACKEND", "services.search_backends.ORMSearchBackend"))()
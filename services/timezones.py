@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+from django.http import HttpRequest
+
+from schemora.settings.helpers import (
+    get_datetime_in_timezone,
+    get_request_user_settings,
+    get_timezone,
+    get_user_timezone,
+)
+
+# Формат дат страниц форума ("H:i, d/m/Y" в шаблонах) и API.
+TEMPLATE_DATETIME_FORMAT = "%H:%M, %d/%m/%Y"
+API_DATETIME_FORMAT = "%H:%M %d/%m/%Y"
+
+
+class TimezoneFormatter(object):
+    """
+    Перевод дат в зону пользователя и их форматирование. Объект зоны получается один раз
+    при создании форматтера, поэтому перевод каждой даты - только astimezone и strftime.
+    """
+
+    def __init__(self, timezone: Optional[str]):
+        # Имя зоны из настроек пользователя (например, 'Default') и зона, в которую переводятся даты.
+        self.timezone = timezone
+        self.zone = get_timezone(timezone)
+
+    def convert(self, dt: Optional[datetime]) -> Optional[datetime]:
+        return get_datetime_in_timezone(dt, self.zone) if dt is not None else None
+
+    def format(self, dt: Optional[datetime], fmt: str = API_DATETIME_FORMAT) -> Optional[str]:
+        return get_datetime_in_timezone(dt, self.zone).strftime(fmt) if dt is not None else None
+
+
+@lru_cache(maxsize=None)
+def get_timezone_formatter(timezone: Optional[str]) -> TimezoneFormatter:
+    """ Функция для получения форматтера зоны. Форматтеры не изменяемы и общие для всех запросов. """
+
+    return TimezoneFormatter(timezone)
+
+
+def get_request_timezone_formatter(request: HttpRequest) -> TimezoneFormatter:
+    """ Функция для получения форматтера зоны текущего пользователя, запомненного на время запроса. """
+
+    http_request = getattr(request, "_request", request)
+    if not hasattr(http_request, "timezone_formatter"):
+        timezone = get_user_timezone(get_request_user_settings(request))
+        setattr(http_request, "timezone_formatter", get_timezone_formatter(timezone))
+    return getattr(http_request, "timezone_formatter")
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from typing import Iterable, List, Literal, Optional, Type
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from forum_app.models import Comment, Topic
+from schemora.cache import CacheNamespace
+from schemora.settings.helpers import get_user_settings_model
+
+UserSettings = get_user_settings_model()
+
+# Поколения фрагментов страниц тем: сущность - id темы.
+topic_fragments_cache = CacheNamespace(settings.TOPIC_FRAGMENTS_VERSION_CACHE_NAME)
+
+
+def get_topic_fragments_version(topic_id: int) -> int:
+    """
+    Функция для получения версии фрагментов страницы темы, входящей в ключи фрагментов
+    (теги {% cache %} шаблона forum/some_id.html).
+    """
+
+    return topic_fragments_cache.get_generation(topic_id)
+
+
+def bump_topic_fragments_versions(topic_ids: Iterable[int]) -> Literal[None]:
+    """ Функция для смены версий фрагментов тем: старые фрагменты больше не читаются и вытесняются из кэша. """
+
+    return topic_fragments_cache.invalidate_many(topic_ids)
+
+
+def get_author_topic_ids(user_id: int) -> List[int]:
+    """ Функция для получения id тем, на страницах которых есть сообщения пользователя (один запрос). """
+
+    topics = Topic.objects.order_by().filter(author_id=user_id).values_list("pk", flat=True)
+    return list(topics.union(Comment.objects.order_by().filter(author_id=user_id).values_list("topic_id", flat=True)))
+
+
+def _bump_on_commit(topic_ids: Iterable[int]) -> Literal[None]:
+    # Версия меняется после фиксации транзакции, иначе параллельный запрос может закэшировать
+    # под новой версией страницу, прочитанную до фиксации.
+    topic_ids = tuple(topic_ids)
+    transaction.on_commit(lambda: bump_topic_fragments_versions(topic_ids))
+    return None
+
+
+def _on_comment_change(sender: Type[Comment], instance: Comment, **kwargs) -> Literal[None]:
+    return _bump_on_commit((instance.topic_id,))
+
+
+def _on_topic_change(sender: Type[Topic], instance: Topic, created: bool = False, **kwargs) -> Literal[None]:
+    return None if created else _bump_on_commit((instance.pk,))
+
+
+def _on_user_settings_change(sender: Type[UserSettings], instance: UserSettings, created: bool = False,
+                             update_fields: Optional[Iterable[str]] = None, **kwargs) -> Literal[None]:
+    # Временная зона входит в ключи фрагментов, аватар и подпись - нет.
+    if created or (update_fields is not None and set(update_fields) <= {"timezone"}):
+        return None
+    return _bump_on_commit(get_author_topic_ids(instance.user_id))
+
+
+def connect_signals() -> Literal[None]:
+    """ Подключение обработчиков, меняющих версии фрагментов при изменении отображаемых на странице темы данных. """
+
+    post_save.connect(_on_comment_change, sender=Comment, dispatch_uid="topic_fragments_comment_save")
+    post_delete.connect(_on_comment_change, sender=Comment, dispatch_uid="topic_fragments_comment_delete")
+    post_save.connect(_on_topic_change, sender=Topic, dispatch_uid="topic_fragments_topic_save")
+    post_delete.connect(_on_topic_change, sender=Topic, dispatch_uid="topic_fragments_topic_delete")
+    post_save.connect(_on_user_settings_change, sender=UserSettings, dispatch_uid="topic_fragments_settings_save")
+    return None
@@ -7,7 +7,7 @@ from schemora.core.types import E
 from schemora.settings.handlers import BaseHandler
 from schemora.settings.helpers import get_user_settings_model
 from schemora.settings.mixins import BaseDataValidationHandlerMixin
-from tasks.home_app_tasks import make_center_crop
+from tasks.home_app_tasks import make_image_variants
 
 UserSettings = get_user_settings_model()
 
@@ -28,7 +28,7 @@ class AvatarHandlerBase(BaseHandler, BaseDataValidationHandlerMixin):
         obj = self.data_validation_update_setting(setting, user_settings, kwargs["request_host"])
         if isinstance(obj, E):
             return obj
-        make_center_crop.delay(obj.avatar.path)
+        make_image_variants.delay(obj.avatar.path)
         return None
 
     def get_data_to_serializer(self, data: Dict, files: Dict) -> Dict:
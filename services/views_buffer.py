@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from itertools import islice
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, Literal, Sequence, cast
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from redis import Redis
+
+from forum_app.models import Comment, Topic, TopicViewsFlush
+from schemora.cache import get_redis_client
+
+TopicId = int
+PendingViews = Dict[TopicId, int]
+
+
+def apply_pending_views(pending: PendingViews, batch_size: int = 500) -> int:
+    """
+    Функция для переноса накопленных просмотров в Topic.views: один UPDATE ... CASE
+    на пачку тем вместо UPDATE на каждый просмотр. Возвращает количество обновленных тем.
+    """
+
+    updated, items = 0, iter(pending.items())
+    while batch := tuple(islice(items, batch_size)):
+        increment = Case(*(When(pk=pk, then=Value(count)) for pk, count in batch),
+                         default=Value(0), output_field=PositiveIntegerField())
+        updated += Topic.objects.filter(pk__in=[pk for pk, _ in batch]).update(views=F("views") + increment)
+    return updated
+
+
+def apply_pending_views_once(flush_id: str, pending: PendingViews) -> int:
+    """
+    Функция для переноса просмотров буфера flush_id ровно один раз: просмотры и отметка переноса
+    записываются в одной транзакции, уже перенесенный буфер пропускается (возвращается 0).
+    """
+
+    with transaction.atomic():
+        if is_views_flush_applied(flush_id):
+            return 0
+        updated = apply_pending_views(pending)
+        # Буферы переносятся по одному, поэтому нужна только отметка последнего.
+        TopicViewsFlush.objects.all().delete()
+        TopicViewsFlush.objects.create(flush_id=flush_id)
+    return updated
+
+
+def is_views_flush_applied(flush_id: str) -> bool:
+    return TopicViewsFlush.objects.filter(flush_id=flush_id).exists()
+
+
+class BaseViewsBuffer(ABC):
+    """ Буфер просмотров тем: просмотры копятся по id темы и периодически переносятся в базу. """
+
+    @abstractmethod
+    def increment(self, topic_id: TopicId) -> int:
+        """ Метод для учета просмотра. Возвращает количество еще не перенесенных в базу просмотров темы. """
+
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_pending(self, topic_ids: Sequence[TopicId]) -> PendingViews:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def flush(self) -> int:
+        """ Метод для переноса накопленных просмотров в базу. Возвращает количество обновленных тем. """
+
+        raise NotImplementedError()
+
+    def add_pending_views(self, topics: Iterable[Topic | Comment]) -> Literal[None]:
+        """ Прибавляет к views загруженных тем еще не перенесенные в базу просмотры (один запрос к буферу). """
+
+        loaded = [topic for topic in topics if isinstance(topic, Topic)]
+        pending = self.get_pending([topic.pk for topic in loaded]) if loaded else {}
+        for topic in loaded:
+            topic.views += pending.get(topic.pk, 0)
+        return None
+
+
+class RedisViewsBuffer(BaseViewsBuffer):
+    """
+    Буфер в хэше Redis (HINCRBY). При переносе хэш атомарно переименовывается и получает id переноса,
+    поэтому новые просмотры копятся в новом хэше, а необработанный после сбоя хэш
+    будет перенесен следующим вызовом flush. Просмотры хэша попадают в базу ровно один раз:
+    id переноса фиксируется в одной транзакции с ними (apply_pending_views_once).
+    """
+
+    def __init__(self, redis_cache: RedisCache):
+        self.cache = redis_cache
+        self.key = redis_cache.make_and_validate_key("topic_views_buffer")
+        self.flushing_key = f"{self.key}:flushing"
+        self.flush_id_key = f"{self.key}:flush_id"
+        self.lock_key = "topic_views_buffer_lock"
+
+    @property
+    def client(self) -> Redis:
+        return get_redis_client(self.cache, self.key)
+
+    def increment(self, topic_id: TopicId) -> int:
+        # Клиент redis-py типизирован и для asyncio, поэтому ответы приводятся к типам синхронного клиента.
+        return cast(int, self.client.hincrby(self.key, str(topic_id), 1))
+
+    def get_pending(self, topic_ids: Sequence[TopicId]) -> PendingViews:
+        # Просмотры, которые переносятся в базу прямо сейчас, тоже еще не видны в Topic.views.
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.hmget(self.key, list(topic_ids))
+        pipeline.hmget(self.flushing_key, list(topic_ids))
+        pipeline.get(self.flush_id_key)
+        pending, flushing, flush_id = pipeline.execute()
+        # Хэш, перенос которого уже зафиксирован в базе, но который еще не удален, учтен в Topic.views.
+        if any(flushing) and flush_id and is_views_flush_applied(flush_id.decode()):
+            flushing = [None] * len(flushing)
+        return {pk: int(a or 0) + int(b or 0) for pk, a, b in zip(topic_ids, pending, flushing) if a or b}
+
+    def flush(self) -> int:
+        if not self.cache.add(self.lock_key, 1, timeout=settings.FORUM_VIEWS_FLUSH_INTERVAL):
+            return 0
+        try:
+            client = self.client
+            if not client.exists(self.flushing_key):
+                if not client.exists(self.key):
+                    return 0
+                pipeline = client.pipeline(transaction=True)
+                pipeline.rename(self.key, self.flushing_key)
+                pipeline.set(self.flush_id_key, uuid4().hex)
+                pipeline.execute()
+            flushing = cast(Dict[bytes, bytes], client.hgetall(self.flushing_key))
+            pending = {int(pk): int(count) for pk, count in flushing.items()}
+            updated = apply_pending_views_once(self._get_flush_id(client), pending)
+            client.delete(self.flushing_key, self.flush_id_key)
+            return updated
+        finally:
+            self.cache.delete(self.lock_key)
+
+    def _get_flush_id(self, client: Redis) -> str:
+        # Хэш мог остаться без id переноса, если он был переименован до появления id.
+        client.set(self.flush_id_key, uuid4().hex, nx=True)
+        return cast(bytes, client.get(self.flush_id_key)).decode()
+
+
+class LocalViewsBuffer(BaseViewsBuffer):
+    """
+    Буфер в памяти процесса для окружений без Redis (dev, тесты). Другие процессы его не видят,
+    поэтому он сам переносит просмотры в базу при учете просмотра не чаще раза в flush_interval секунд.
+    """
+
+    def __init__(self, flush_interval: int):
+        self.pending: PendingViews = dict()
+        self.flush_interval = flush_interval
+        self.flushed_at = monotonic()
+        self.lock = Lock()
+
+    def increment(self, topic_id: TopicId) -> int:
+        with self.lock:
+            count = self.pending[topic_id] = self.pending.get(topic_id, 0) + 1
+        if monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+            return 0
+        return count
+
+    def get_pending(self, topic_ids: Sequence[TopicId]) -> PendingViews:
+        with self.lock:
+            return {pk: self.pending[pk] for pk in topic_ids if pk in self.pending}
+
+    def flush(self) -> int:
+        with self.lock:
+            pending, self.pending, self.flushed_at = self.pending, dict(), monotonic()
+        return apply_pending_views(pending) if pending else 0
+
+
+@lru_cache(maxsize=None)
+def get_views_buffer() -> BaseViewsBuffer:
+    """ Функция для получения буфера просмотров: Redis, если он используется как кэш, иначе буфер процесса. """
+
+    default_cache = caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(default_cache, RedisCache):
+        return RedisViewsBuffer(default_cache)
+    return LocalViewsBuffer(settings.FORUM_VIEWS_FLUSH_INTERVAL)
@@ -0,0 +1,20 @@
+from typing import List
+
+from celery import shared_task
+
+from services.image_variants import delete_uploads
+
+
+@shared_task
+def flush_topic_views() -> int:
+    """ Периодическая таска для переноса накопленных в буфере просмотров тем в базу. """
+
+    from services.views_buffer import get_views_buffer
+    return get_views_buffer().flush()
+
+
+@shared_task
+def delete_upload_files(upload_names: List[str]) -> int:
+    """ Таска для удаления пакета файлов вложений (исходных и их вариантов) после удаления сообщений. """
+
+    return delete_uploads(upload_names)
@@ -1,31 +1,28 @@
-import os
-from typing import Literal
+from typing import Dict, List, Literal
 
 from celery import shared_task
-from PIL import Image
-from PIL.Image import Image as Im
 
-from forum.settings import BASE_DIR
-from schemora.settings.helpers import get_upload_crop_path
+from services.image_variants import build_image_variants, build_image_variants_batch
 
 
 @shared_task
-def make_center_crop(applicant_avatar_path: str) -> Literal[None]:
-    """ Таска для центрирования аватарки/вложения. """
+def make_image_variants(upload_path: str) -> Literal[None]:
+    """ Таска для создания вариантов аватарки/вложения разных размеров (services.image_variants). """
+
+    build_image_variants(upload_path)
+    return None
+
 
-    _center_crop(Image.open(os.path.join(BASE_DIR / applicant_avatar_path))).save(os.path.join(
-        get_upload_crop_path(applicant_avatar_path)
-    ))
+@shared_task
+def make_center_crop(applicant_avatar_path: str) -> Literal[None]:
+    """ Таска для центрирования аватарки/вложения. Оставлена для задач, поставленных до появления вариантов. """
 
+    return make_image_variants(applicant_avatar_path)
 
-def _center_crop(img: Im) -> Im:
-    width, height = img.size
-    if width / height == 1:
-        return img
 
-    left = (width - min(width, height)) / 2
-    top = (height - min(width, height)) / 2
-    right = (width + min(width, height)) / 2
-    bottom = (height + min(width, height)) / 2
+@shared_task
+def make_image_variants_batch(upload_paths: List[str]) -> Dict:
+    """ Таска для создания вариантов многих изображений за один вызов в пуле процессов. """
 
-    return img.crop((int(left), int(top), int(right), int(bottom)))
+    result = build_image_variants_batch(upload_paths)
+    return {"processed": result.processed, "failed": result.failed}